@@ -1,22 +1,143 @@
 import streamlit as st
 import sqlite3
-import pandas as pd
 import io
 import logging
+import os
 from database import (
-    init_db, add_vehicle, get_vehicles, update_vehicle, delete_vehicle,
-    add_maintenance, get_vehicle_maintenance, update_maintenance, delete_maintenance,
-    get_all_maintenance_records
+    init_db, add_vehicle, query_vehicles, get_vehicle_brands, get_vehicle_models, update_vehicle, delete_vehicle,
+    add_maintenance, get_vehicle_maintenance, get_maintenance_by_vehicles, get_vehicle_image,
+    update_maintenance, delete_maintenance,
+    get_vehicle_labels,
+    get_fleet_summary, get_maintenance_cost_by_month, get_maintenance_cost_by_author
 )
-from fipe_api import get_fipe_brands, get_fipe_models, get_fipe_years, get_fipe_price
-from vehicle_manager import save_image
-import base64
+import metrics
+from fipe_api import (
+    get_cache_stats, get_fipe_brand_index, get_fipe_model_index, get_fipe_year_index, get_fipe_price,
+    prefetch_brand, prefetch_model, parse_fipe_price, parse_fipe_month
+)
+from vehicle_manager import DERIVATIVES, store_vehicle_image, image_url
+from reports import write_maintenance_report
+from importer import ImportValidationError, import_vehicles, import_maintenance
+from revaluation import revalue_fleet
+from depreciation import vehicle_value_vs_cost, model_depreciation, vehicles_price_history
+import tempfile
 from io import BytesIO
 from datetime import datetime, timedelta
 
 # Configuração do logger
 logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Estilos da interface mobile e das imagens responsivas, em um único bloco
+APP_CSS = """
+    <style>
+    [data-testid="stSidebar"][aria-expanded="true"] {
+        max-width: 80%;
+        width: 80%;
+    }
+    .streamlit-expanderHeader {
+        font-size: 1em;
+    }
+    .stButton > button {
+        width: 100%;
+        border-radius: 20px;
+        height: 50px;
+        margin: 5px 0;
+    }
+    .stSelectbox {
+        margin: 10px 0;
+    }
+    .vehicle-info {
+        font-size: 18px !important;
+        line-height: 2 !important;
+        padding: 10px 0;
+    }
+    .vehicle-info p {
+        margin: 10px 0 !important;
+    }
+    .maintenance-card {
+        background-color: var(--background-color);
+        color: var(--text-color);
+        padding: 1rem;
+        border-radius: 0.5rem;
+        margin: 0.5rem 0;
+        border: 1px solid var(--border-color);
+    }
+
+    /* Tema claro */
+    [data-theme="light"] .maintenance-card,
+    .maintenance-card {
+        --background-color: #f0f2f6;
+        --text-color: #0f1116;
+        --border-color: #e6e6e6;
+    }
+
+    /* Tema escuro */
+    [data-theme="dark"] .maintenance-card {
+        --background-color: #2d3035;
+        --text-color: #ffffff;
+        --border-color: #444444;
+    }
+
+    /* Imagens responsivas */
+    .responsive-img {
+        max-width: 100% !important;
+        height: auto !important;
+        margin: 0 auto !important;
+        display: block !important;
+        border-radius: 10px !important;
+        box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1) !important;
+    }
+    .img-container {
+        position: relative !important;
+        width: 100% !important;
+        max-width: 500px !important;
+        margin: 0 auto !important;
+        padding: 10px !important;
+        overflow: hidden !important;
+    }
+    [data-testid="stImage"] > img {
+        max-height: 400px !important;
+        width: auto !important;
+        object-fit: contain !important;
+        margin: 0 auto !important;
+    }
+
+    /* Desktop */
+    @media (min-width: 768px) {
+        .img-container {
+            max-width: 400px !important;
+            padding: 10px !important;
+            margin: 1rem auto !important;
+        }
+        [data-testid="stImage"] > img {
+            max-height: 300px !important;
+            max-width: 100% !important;
+        }
+    }
+
+    /* Mobile */
+    @media (max-width: 767px) {
+        .img-container {
+            max-width: 100% !important;
+            padding: 5px !important;
+        }
+    }
+    @media (max-width: 640px) {
+        .main > div {
+            padding-left: 0.5rem;
+            padding-right: 0.5rem;
+        }
+    }
+    </style>
+"""
+
+@st.cache_resource
+def setup():
+    """
+    Configuração feita uma vez por processo, fora do caminho de cada rerun
+    """
+    init_db()
+
 def main():
     try:
         # Configuração da página para mobile
@@ -29,179 +150,24 @@ def main():
             }
         )
         
-        # Configurações para melhor experiência mobile
-        st.markdown("""
-            <style>
-            [data-testid="stSidebar"][aria-expanded="true"] {
-                max-width: 80%;
-                width: 80%;
-            }
-            .streamlit-expanderHeader {
-                font-size: 1em;
-            }
-            .stButton > button {
-                width: 100%;
-                border-radius: 20px;
-                height: 3em;
-            }
-            @media (max-width: 640px) {
-                .main > div {
-                    padding-left: 0.5rem;
-                    padding-right: 0.5rem;
-                }
-            }
-            </style>
-        """, unsafe_allow_html=True)
-        st._config.set_option('server.address', '0.0.0.0')
-
-        # CSS para melhorar a interface mobile e tornar imagens responsivas
-        st.markdown("""
-            <style>
-            .stButton>button {
-                width: 100%;
-                height: 50px;
-                margin: 5px 0;
-            }
-            .stSelectbox {
-                margin: 10px 0;
-            }
-            .vehicle-info {
-                font-size: 18px !important;
-                line-height: 2 !important;
-                padding: 10px 0;
-            }
-            .vehicle-info p {
-                margin: 10px 0 !important;
-            }
-            .delete-button {
-                background-color: #ff4b4b !important;
-                color: white !important;
-                border: none !important;
-                padding: 0.5rem !important;
-                border-radius: 0.3rem !important;
-                cursor: pointer !important;
-            }
-            .maintenance-card {
-                background-color: var(--background-color);
-                color: var(--text-color);
-                padding: 1rem;
-                border-radius: 0.5rem;
-                margin: 0.5rem 0;
-                border: 1px solid var(--border-color);
-            }
-
-            /* Tema claro */
-            [data-theme="light"] .maintenance-card,
-            .maintenance-card {
-                --background-color: #f0f2f6;
-                --text-color: #0f1116;
-                --border-color: #e6e6e6;
-            }
-
-            /* Tema escuro */
-            [data-theme="dark"] .maintenance-card {
-                --background-color: #2d3035;
-                --text-color: #ffffff;
-                --border-color: #444444;
-            }
-
-            /* Estilos para imagens responsivas */
-            .responsive-img {
-                max-width: 100%;
-                height: auto;
-                margin: 0 auto;
-                display: block;
-                border-radius: 10px;
-                box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-            }
-            .img-container {
-                position: relative;
-                width: 100%;
-                max-width: 800px;
-                margin: 0 auto;
-                padding: 10px;
-            }
-            /* Media queries para diferentes tamanhos de tela */
-            @media (max-width: 768px) {
-                .img-container {
-                    max-width: 100%;
-                    padding: 5px;
-                }
-            }
-            /* Ajustes específicos para imagens responsivas */
-            .responsive-img {
-                max-width: 100% !important;
-                height: auto !important;
-                margin: 0 auto !important;
-                display: block !important;
-                border-radius: 10px !important;
-                box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1) !important;
-            }
-            .img-container {
-                position: relative !important;
-                width: 100% !important;
-                max-width: 500px !important;  /* Reduzido de 800px para 500px */
-                margin: 0 auto !important;
-                padding: 10px !important;
-                overflow: hidden !important;
-            }
-            /* Forçar imagem a ficar dentro do container em telas pequenas */
-            @media (max-width: 768px) {
-                .img-container {
-                    max-width: 100% !important;
-                    padding: 5px !important;
-                }
-            }
-            /* Estilos para a imagem dentro do container */
-            [data-testid="stImage"] > img {
-                max-height: 400px !important;  /* Altura máxima adicionada */
-                width: auto !important;
-                object-fit: contain !important;
-                margin: 0 auto !important;
-            }
-
-            /* Ajuste específico para desktop */
-            @media (min-width: 768px) {
-                .img-container {
-                    max-width: 400px !important;  /* Reduzido para telas maiores */
-                    padding: 10px !important;
-                    margin: 1rem auto !important;
-                }
-                [data-testid="stImage"] > img {
-                    max-height: 300px !important;  /* Altura máxima reduzida para desktop */
-                    max-width: 100% !important;
-                    width: auto !important;
-                    object-fit: contain !important;
-                    margin: 0 auto !important;
-                }
-            }
-
-            /* Ajuste específico para mobile (mantém as configs anteriores) */
-            @media (max-width: 767px) {
-                .img-container {
-                    max-width: 100% !important;
-                    padding: 5px !important;
-                }
-                [data-testid="stImage"] > img {
-                    max-height: 400px !important;
-                    width: auto !important;
-                    object-fit: contain !important;
-                }
-            }
-            </style>
-        """, unsafe_allow_html=True)
+        # Um único bloco de CSS; o Streamlit exige reenviá-lo a cada rerun
+        st.markdown(APP_CSS, unsafe_allow_html=True)
 
         st.title("Gerenciador de Veículos")
-        init_db()
+        setup()
 
-        # Menu mais amigável para mobile
-        menu = st.selectbox(
-            "Escolha uma opção",
-            ["Adicionar Veículo", "Visualizar Veículos"]
-        )
+        # Menu mais amigável para mobile; o diagnóstico só aparece com ?diagnostico na URL
+        options = ["Painel da Frota", "Adicionar Veículo", "Visualizar Veículos"]
+        if "diagnostico" in st.query_params:
+            options.append("Diagnóstico")
+        menu = st.selectbox("Escolha uma opção", options)
 
-        if menu == "Adicionar Veículo":
+        if menu == "Painel da Frota":
+            view_dashboard()
+        elif menu == "Adicionar Veículo":
             add_vehicle_form()
+        elif menu == "Diagnóstico":
+            view_diagnostics()
         else:
             view_vehicles()
     except Exception as e:
@@ -211,6 +177,62 @@ def main():
         st.title("Bem-vindo ao Gerenciador de Veículos")
         st.sidebar.title("Menu")
 
+@metrics.timed('section')
+def view_dashboard():
+    st.header("Painel da Frota")
+
+    # Totais lidos das tabelas de resumo mantidas pelo banco, sem percorrer os registros
+    summary = get_fleet_summary()
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("🚗 Veículos", summary['vehicle_count'])
+        st.metric("💵 Total Investido", f"R$ {summary['total_invested']:.2f}")
+    with col2:
+        st.metric("📊 Valor FIPE Total", f"R$ {summary['total_fipe']:.2f}")
+        st.metric("📈 Diferença FIPE", f"R$ {summary['margin']:.2f}")
+
+    if st.button("🔄 Atualizar Valores FIPE da Frota", use_container_width=True):
+        progress_bar = st.progress(0.0, text="Consultando a tabela FIPE...")
+        result = revalue_fleet(
+            progress=lambda done, total: progress_bar.progress(done / total, text=f"{done}/{total} veículos")
+        )
+        st.success(f"{result.updated} veículos atualizados.")
+        for vehicle, error in result.failures:
+            st.error(f"{vehicle['brand']} {vehicle['model']} ({vehicle['year']}): {error}")
+
+    st.subheader("🔧 Gastos com Manutenção por Mês")
+    monthly = get_maintenance_cost_by_month()
+    if monthly:
+        st.bar_chart(
+            {'Mês': [row['month'] for row in monthly], 'Custo (R$)': [row['total_cost'] for row in monthly]},
+            x='Mês',
+            y='Custo (R$)'
+        )
+    else:
+        st.info("Nenhuma manutenção registrada.")
+
+    st.subheader("📉 Depreciação por Modelo")
+    brands = get_vehicle_brands()
+    if brands:
+        col1, col2 = st.columns(2)
+        with col1:
+            brand = st.selectbox("Marca", brands, key="depreciation_brand")
+        with col2:
+            model = st.selectbox("Modelo", ["Todos"] + get_vehicle_models(brand), key="depreciation_model")
+        depreciation = model_depreciation(brand, None if model == "Todos" else model)
+        if depreciation.empty:
+            st.info("Ainda não há histórico de valores FIPE para esta seleção.")
+        else:
+            st.line_chart(depreciation.set_index('month_label')['price'])
+            st.caption(f"Depreciação no período: {depreciation['depreciation'].iloc[-1]:.1%}")
+
+    st.subheader("👤 Gastos por Autor")
+    for row in get_maintenance_cost_by_author():
+        st.markdown(
+            f"**{row['author'] or 'Não informado'}:** R$ {row['total_cost']:.2f} "
+            f"({row['record_count']} manutenções)"
+        )
+
 def add_maintenance_form(vehicle_id, maintenance_data=None):
     is_editing = maintenance_data is not None
     
@@ -280,8 +302,10 @@ def add_maintenance_form(vehicle_id, maintenance_data=None):
             except Exception as e:
                 st.error(f"Erro ao {'atualizar' if is_editing else 'registrar'} manutenção: {str(e)}")
 
-def view_maintenance_history(vehicle_id):
-    maintenance_records = get_vehicle_maintenance(vehicle_id)
+@metrics.timed('section')
+def view_maintenance_history(vehicle_id, maintenance_records=None):
+    if maintenance_records is None:
+        maintenance_records = get_vehicle_maintenance(vehicle_id)
     
     # Inicializar o estado de confirmação de exclusão se não existir
     if 'delete_confirmation' not in st.session_state:
@@ -358,36 +382,53 @@ def view_maintenance_history(vehicle_id):
     else:
         st.info("Nenhuma manutenção registrada para este veículo.")
 
+def searchable_selectbox(label, index, current=None):
+    """
+    Selectbox sobre um CatalogIndex da FIPE com um campo de busca acima.
+    A busca ignora acentos e maiúsculas, casa prefixos de palavras e
+    tolera erros de digitação.
+    """
+    query = st.text_input(f"Buscar {label.split()[0].lower()}", placeholder="Digite para filtrar")
+    options = index.search(query) if query.strip() else index.names
+    if not options:
+        st.caption("Nenhum resultado para a busca; mostrando todos.")
+        options = index.names
+    if options is index.names:
+        position = index.position.get(current, 0)
+    else:
+        # No máximo SEARCH_LIMIT resultados
+        position = options.index(current) if current in options else 0
+    return st.selectbox(label, options=options, index=position)
+
+@metrics.timed('section')
 def add_vehicle_form(vehicle_data=None):
     is_editing = vehicle_data is not None
     st.header("Editar Veículo" if is_editing else "Adicionar Novo Veículo")
 
     try:
         with st.container():
-            # Carregar marcas com cache
-            brands = get_fipe_brands()
-            
-            # Simplificar seleção de marca
-            brand_options = {row['nome']: row['codigo'] for _, row in brands.iterrows()}
-            selected_brand_name = st.selectbox(
-                "Marca do Veículo",
-                options=list(brand_options.keys()),
-                index=0 if not is_editing else list(brand_options.keys()).index(vehicle_data['brand'])
+            # Índices da FIPE em cache: cada rerun faz só consultas em dicionário
+            brand_index = get_fipe_brand_index()
+            selected_brand_name = searchable_selectbox(
+                "Marca do Veículo", brand_index, vehicle_data['brand'] if is_editing else None
             )
-            selected_brand = brand_options[selected_brand_name]
+            selected_brand = brand_index.code(selected_brand_name)
+
+            # Adianta em segundo plano os anos dos modelos mais prováveis
+            prefetch_brand(selected_brand, get_vehicle_models(selected_brand_name))
 
             # Carregar modelos com tratamento de erro
             try:
                 with st.spinner('Carregando modelos...'):
-                    models = get_fipe_models(selected_brand)
-                    if not models.empty and 'codigo' in models.columns:
-                        model_options = {row['nome']: row['codigo'] for _, row in models.iterrows()}
-                        selected_model_name = st.selectbox(
-                            "Modelo do Veículo",
-                            options=list(model_options.keys()),
-                            index=0 if not is_editing else list(model_options.keys()).index(vehicle_data['model'])
+                    model_index = get_fipe_model_index(selected_brand)
+                    if len(model_index):
+                        selected_model_name = searchable_selectbox(
+                            "Modelo do Veículo", model_index, vehicle_data['model'] if is_editing else None
                         )
-                        selected_model = model_options[selected_model_name]
+                        selected_model = model_index.code(selected_model_name)
+
+                        # Adianta em segundo plano os preços de todos os anos do modelo
+                        prefetch_model(selected_brand, selected_model)
                     else:
                         st.error("Erro ao carregar modelos. Tente novamente mais tarde.")
                         return
@@ -399,15 +440,14 @@ def add_vehicle_form(vehicle_data=None):
             # Carregar anos com tratamento de erro
             try:
                 with st.spinner('Carregando anos...'):
-                    years = get_fipe_years(selected_brand, selected_model)
-                    if not years.empty and 'codigo' in years.columns:
-                        year_options = {row['nome']: row['codigo'] for _, row in years.iterrows()}
+                    year_index = get_fipe_year_index(selected_brand, selected_model)
+                    if len(year_index):
                         selected_year_name = st.selectbox(
                             "Ano do Veículo",
-                            options=list(year_options.keys()),
-                            index=0 if not is_editing else list(year_options.keys()).index(vehicle_data['year'])
+                            options=year_index.names,
+                            index=year_index.position.get(vehicle_data['year'], 0) if is_editing else 0
                         )
-                        selected_year = year_options[selected_year_name]
+                        selected_year = year_index.code(selected_year_name)
                     else:
                         st.error("Erro ao carregar anos. Tente novamente mais tarde.")
                         return
@@ -451,15 +491,15 @@ def add_vehicle_form(vehicle_data=None):
     if st.button(button_text, use_container_width=True):
         try:
             fipe_data = get_fipe_price(selected_brand, selected_model, selected_year)
-            fipe_price = float(fipe_data['Valor'].replace('R$ ', '').replace('.', '').replace(',', '.'))
+            fipe_price = parse_fipe_price(fipe_data)
 
             # Mantém a imagem existente se não houver upload de nova imagem
             if is_editing:
-                image_data = vehicle_data['image_data']
+                image_hash = vehicle_data['image_hash']
                 if uploaded_file:
-                    image_data = save_image(uploaded_file)
+                    image_hash = store_vehicle_image(uploaded_file)
             else:
-                image_data = save_image(uploaded_file)
+                image_hash = store_vehicle_image(uploaded_file)
 
             total_cost = purchase_price + additional_costs
             fipe_difference = fipe_price - total_cost
@@ -472,7 +512,8 @@ def add_vehicle_form(vehicle_data=None):
                 'purchase_price': purchase_price,
                 'additional_costs': additional_costs,
                 'fipe_price': fipe_price,
-                'image_data': image_data
+                'fipe_month': parse_fipe_month(fipe_data),
+                'image_hash': image_hash
             }
 
             if is_editing:
@@ -489,37 +530,172 @@ def add_vehicle_form(vehicle_data=None):
         except Exception as e:
             st.error(f"Erro ao {'atualizar' if is_editing else 'salvar'} veículo: {str(e)}")
 
+@metrics.timed('section')
 def export_maintenance_report():
-    records = get_all_maintenance_records()
-    if records:
-        df = pd.DataFrame(records)
-        df = df[[
-            'date', 'brand', 'model', 'year', 'description',
-            'cost', 'mileage'
-        ]]
-        df.columns = [
-            'Data', 'Marca', 'Modelo', 'Ano', 'Descrição',
-            'Custo', 'Quilometragem'
-        ]
-        
-        csv = df.to_csv(index=False)
-        
-        st.download_button(
-            label="📥 Exportar Relatório de Manutenções",
-            data=csv,
-            file_name="relatorio_manutencoes.csv",
-            mime="text/csv"
-        )
-    else:
-        st.info("Não há registros de manutenção para exportar.")
+    # O relatório só é montado quando o usuário pede, lendo o banco em blocos
+    with st.expander("📥 Exportar Relatório de Manutenções"):
+        with st.form("export_maintenance_report"):
+            col1, col2 = st.columns(2)
+            with col1:
+                date_from = st.date_input("De", value=None, format="DD/MM/YYYY")
+            with col2:
+                date_to = st.date_input("Até", value=None, format="DD/MM/YYYY")
+
+            vehicle_labels = get_vehicle_labels()
+            vehicle_ids = st.multiselect(
+                "Veículos (vazio = todos)",
+                options=list(vehicle_labels.keys()),
+                format_func=vehicle_labels.get
+            )
+            compress = st.checkbox("Compactar (gzip)")
+            submit = st.form_submit_button("Gerar Relatório")
+
+        if submit:
+            # O relatório vai direto para o disco; o download recebe o arquivo
+            # aberto, sem uma cópia intermediária em memória
+            with tempfile.TemporaryDirectory(prefix='carro-relatorio-') as workdir:
+                path = os.path.join(workdir, 'relatorio')
+                with open(path, 'wb') as report:
+                    written = write_maintenance_report(
+                        report,
+                        compress=compress,
+                        date_from=date_from.strftime('%Y-%m-%d') if date_from else None,
+                        date_to=date_to.strftime('%Y-%m-%d') if date_to else None,
+                        vehicle_ids=vehicle_ids
+                    )
+                if written:
+                    with open(path, 'rb') as report:
+                        st.download_button(
+                            label="📥 Baixar Relatório",
+                            data=report,
+                            file_name="relatorio_manutencoes.csv" + (".gz" if compress else ""),
+                            mime="application/gzip" if compress else "text/csv"
+                        )
+                else:
+                    st.info("Não há registros de manutenção para exportar.")
+
+@metrics.timed('section')
+def import_data_form():
+    with st.expander("📤 Importar Veículos ou Manutenções"):
+        with st.form("import_data"):
+            kind = st.radio("Importar", ["Manutenções", "Veículos"], horizontal=True)
+            uploaded = st.file_uploader("Arquivo CSV ou JSON", type=['csv', 'json', 'jsonl', 'ndjson'])
+            author = st.selectbox("Autor das manutenções sem essa coluna", ["Antonio", "Fernando"])
+            skip_invalid = st.checkbox("Importar só as linhas válidas")
+            submit = st.form_submit_button("Importar")
+
+        if not submit:
+            return
+        if uploaded is None:
+            st.warning("Escolha um arquivo para importar.")
+            return
+
+        progress_bar = st.progress(0.0, text="Importando...")
 
+        def progress(done, fraction):
+            progress_bar.progress(fraction or 0.0, text=f"{done} registros importados")
+
+        try:
+            if kind == "Veículos":
+                result = import_vehicles(uploaded, uploaded.name, skip_invalid=skip_invalid, progress=progress)
+            else:
+                result = import_maintenance(
+                    uploaded, uploaded.name, author=author, skip_invalid=skip_invalid, progress=progress
+                )
+        except ImportValidationError as e:
+            progress_bar.empty()
+            st.error(str(e))
+            st.dataframe(
+                [{"Linha": line, "Erro": error} for line, error in e.failures],
+                hide_index=True, use_container_width=True
+            )
+            return
+        except ValueError as e:
+            progress_bar.empty()
+            st.error(f"Erro ao importar: {e}")
+            return
+
+        progress_bar.empty()
+        st.success(f"{result.imported} registros importados.")
+        if result.failures:
+            st.warning(f"{len(result.failures)} linhas ignoradas:")
+            st.dataframe(
+                [{"Linha": line, "Erro": error} for line, error in result.failures],
+                hide_index=True, use_container_width=True
+            )
+
+VEHICLES_PAGE_SIZE = 20
+
+# Rótulo exibido -> (ordenação em query_vehicles, decrescente)
+SORT_OPTIONS = {
+    "Ordem de cadastro": ('id', False),
+    "Mais recentes": ('id', True),
+    "Menor custo total": ('cost', False),
+    "Maior custo total": ('cost', True),
+    "Maior valor FIPE": ('fipe', True),
+    "Maior diferença FIPE": ('margin', True),
+    "Menor diferença FIPE": ('margin', False),
+}
+
+FIPE_DIFFERENCE_OPTIONS = {
+    "Todas": None,
+    "Positiva": 'positive',
+    "Negativa": 'negative',
+}
+
+def vehicle_filters():
+    search = st.text_input("🔍 Buscar por marca ou modelo")
+
+    with st.expander("Filtros e ordenação"):
+        brand = st.selectbox("Marca", ["Todas"] + get_vehicle_brands())
+        model = "Todos"
+        if brand != "Todas":
+            model = st.selectbox("Modelo", ["Todos"] + get_vehicle_models(brand))
+        col1, col2 = st.columns(2)
+        with col1:
+            year_from = st.number_input("Ano inicial", min_value=0, value=0, step=1, help="0 = sem filtro")
+        with col2:
+            year_to = st.number_input("Ano final", min_value=0, value=0, step=1, help="0 = sem filtro")
+        fipe_difference = st.selectbox("Diferença FIPE", list(FIPE_DIFFERENCE_OPTIONS))
+        sort_label = st.selectbox("Ordenar por", list(SORT_OPTIONS))
+
+    sort, descending = SORT_OPTIONS[sort_label]
+    return {
+        'search': search.strip() or None,
+        'brand': None if brand == "Todas" else brand,
+        'model': None if model == "Todos" else model,
+        'year_from': year_from or None,
+        'year_to': year_to or None,
+        'fipe_difference': FIPE_DIFFERENCE_OPTIONS[fipe_difference],
+        'sort': sort,
+        'descending': descending,
+    }
+
+@metrics.timed('section')
 def view_vehicles():
     st.header("Veículos Cadastrados")
     
-    # Botão de exportação no topo da página
+    # Exportação e importação no topo da página
     export_maintenance_report()
+    import_data_form()
+
+    filters = vehicle_filters()
 
-    vehicles = get_vehicles()
+    # Reinicia a paginação quando os filtros mudam
+    if st.session_state.get('vehicle_filters') != filters:
+        st.session_state.vehicle_filters = filters
+        st.session_state.vehicle_cursors = [None]
+
+    # Cada página é buscada a partir do seu cursor, sem reler as anteriores por OFFSET
+    vehicles = []
+    next_cursor = None
+    with metrics.section('view_vehicles.query'):
+        for cursor in st.session_state.vehicle_cursors:
+            page, next_cursor = query_vehicles(limit=VEHICLES_PAGE_SIZE, cursor=cursor, **filters)
+            vehicles.extend(page)
+
+    if not vehicles:
+        st.info("Nenhum veículo encontrado.")
 
     # Inicializa os estados
     if 'delete_vehicle_confirmation' not in st.session_state:
@@ -527,84 +703,181 @@ def view_vehicles():
     if 'editing_vehicle' not in st.session_state:
         st.session_state.editing_vehicle = None
 
+    # Editar e confirmar exclusão mantêm o painel aberto
+    pinned = (st.session_state.editing_vehicle, st.session_state.delete_vehicle_confirmation)
+    # Manutenções e histórico FIPE dos painéis abertos em uma consulta cada;
+    # o estado dos toggles já está na sessão antes de eles serem desenhados
+    open_ids = tuple(
+        vehicle['id'] for vehicle in vehicles
+        if st.session_state.get(f"details_{vehicle['id']}") or vehicle['id'] in pinned
+    )
+    maintenance_by_vehicle = get_maintenance_by_vehicles(open_ids) if open_ids else {}
+    price_history_by_vehicle = vehicles_price_history(open_ids) if open_ids else {}
+
     for vehicle in vehicles:
-        with st.expander(f"{vehicle['brand']} {vehicle['model']} ({vehicle['year']})"):
-            if st.session_state.editing_vehicle == vehicle['id']:
-                add_vehicle_form(vehicle)
-                if st.button("❌ Cancelar Edição", key=f"cancel_{vehicle['id']}", type="primary"):
-                    st.session_state.editing_vehicle = None
-                    st.rerun()
-            else:
-                if vehicle['image_data']:
-                    try:
-                        image_bytes = base64.b64decode(vehicle['image_data'])
-                        with st.container():
-                            st.markdown('<div class="img-container">', unsafe_allow_html=True)
-                            image_col, delete_col = st.columns([6,1])
-                            with image_col:
-                                st.image(
-                                    image_bytes,
-                                    use_container_width=True,
-                                    output_format="PNG",
-                                    caption=f"{vehicle['brand']} {vehicle['model']}",
-                                    clamp=True
-                                )
-                            with delete_col:
-                                if st.button("🗑️", key=f"delete_image_{vehicle['id']}", help="Excluir imagem"):
-                                    vehicle_data = dict(vehicle)
-                                    vehicle_data['image_data'] = None
-                                    update_vehicle(vehicle['id'], vehicle_data)
-                                    st.success("Imagem excluída com sucesso!")
-                                    st.rerun()
-                            st.markdown('</div>', unsafe_allow_html=True)
-                    except Exception as e:
-                        st.error(f"Erro ao carregar imagem: {str(e)}")
-
-                total_cost = vehicle['purchase_price'] + vehicle['additional_costs']
-                difference = vehicle['fipe_price'] - total_cost
-
-                st.markdown(f"""
-                    <div class="vehicle-info">
-                    <p>🎨 <strong>Cor:</strong> {vehicle.get('color', 'Não informada')}</p>
-                    <p>📊 <strong>Valor de Aquisição:</strong> R$ {vehicle['purchase_price']:.2f}</p>
-                    <p>💰 <strong>Custos Adicionais:</strong> R$ {vehicle['additional_costs']:.2f}</p>
-                    <p>💵 <strong>Valor Total:</strong> R$ {total_cost:.2f}</p>
-                    <p>🚗 <strong>Valor FIPE:</strong> R$ {vehicle['fipe_price']:.2f}</p>
-                    <p>📈 <strong>Diferença FIPE:</strong> R$ {difference:.2f}</p>
-                    </div>
-                """, unsafe_allow_html=True)
-
-                if difference > 0:
-                    st.success("✅ Valor positivo em relação à FIPE")
-                else:
-                    st.error("❌ Valor negativo em relação à FIPE")
+        with st.container(border=True):
+            expanded = vehicle_header(vehicle)
+            if expanded or vehicle['id'] in pinned:
+                vehicle_details(
+                    vehicle,
+                    maintenance_by_vehicle.get(vehicle['id']),
+                    price_history_by_vehicle.get(vehicle['id'])
+                )
+
+    if next_cursor is not None:
+        if st.button("⬇️ Carregar mais", use_container_width=True):
+            st.session_state.vehicle_cursors.append(next_cursor)
+            st.rerun()
 
-                # Adiciona seção de manutenções
-                st.subheader("📝 Histórico de Manutenções")
-                view_maintenance_history(vehicle['id'])
+def vehicle_header(vehicle):
+    """
+    Linha leve da lista: miniatura, marca/modelo/ano e a diferença FIPE.
+    Retorna se o painel de detalhes está aberto.
+    """
+    difference = vehicle['fipe_price'] - vehicle['purchase_price'] - vehicle['additional_costs']
+    thumb_col, title_col, toggle_col = st.columns([1, 4, 2], vertical_alignment="center")
+    with thumb_col:
+        # Miniatura servida como arquivo estático: o navegador guarda em cache pela URL
+        thumbnail = image_url(vehicle['image_hash'], 'thumb')
+        if thumbnail:
+            st.markdown(f'<img src="{thumbnail}" width="64" alt="" loading="lazy">', unsafe_allow_html=True)
+        else:
+            st.markdown("🚗")
+    with title_col:
+        color = "green" if difference > 0 else "red"
+        st.markdown(
+            f"**{vehicle['brand']} {vehicle['model']}** ({vehicle['year']})  \n"
+            f":{color}[{'▲' if difference > 0 else '▼'} R$ {difference:.2f} x FIPE]"
+        )
+    with toggle_col:
+        return st.toggle("Detalhes", key=f"details_{vehicle['id']}")
+
+@metrics.timed('section')
+def vehicle_details(vehicle, maintenance_records=None, price_history=None):
+    # Foto, histórico e manutenções são carregados só para os veículos abertos
+    if st.session_state.editing_vehicle == vehicle['id']:
+        add_vehicle_form(vehicle)
+        if st.button("❌ Cancelar Edição", key=f"cancel_{vehicle['id']}", type="primary"):
+            st.session_state.editing_vehicle = None
+            st.rerun()
+    else:
+        # Painel aberto nesta execução sem ter entrado na carga em lote
+        if maintenance_records is None:
+            maintenance_records = get_vehicle_maintenance(vehicle['id'])
+        if price_history is None:
+            price_history = vehicles_price_history([vehicle['id']])[vehicle['id']]
 
-                col1, col2 = st.columns(2)
-                with col1:
-                    if st.button("✏️ Editar", key=f"edit_{vehicle['id']}", type="primary"):
-                        st.session_state.editing_vehicle = vehicle['id']
-                        st.rerun()
+        if vehicle['image_hash']:
+            try:
+                # Bytes gravados no upload, sem reprocessar: URL fixa pelo hash do conteúdo
+                with metrics.section('view_vehicles.image'):
+                    photo_url = image_url(vehicle['image_hash'], 'display')
+                with st.container():
+                    image_col, delete_col = st.columns([6,1])
+                    with image_col:
+                        if photo_url:
+                            st.markdown(f"""
+                                <div class="img-container">
+                                <img class="responsive-img" src="{photo_url}" loading="lazy"
+                                     alt="{vehicle['brand']} {vehicle['model']}">
+                                </div>
+                            """, unsafe_allow_html=True)
+                        else:
+                            # Sem static serving: o Streamlit serve os bytes da menor derivada que cobre a tela
+                            st.image(get_vehicle_image(vehicle['id'], max_size=DERIVATIVES['display'][0][0]))
+                        st.caption(f"{vehicle['brand']} {vehicle['model']}")
+                    with delete_col:
+                        if st.button("🗑️", key=f"delete_image_{vehicle['id']}", help="Excluir imagem"):
+                            vehicle_data = dict(vehicle)
+                            vehicle_data['image_hash'] = None
+                            update_vehicle(vehicle['id'], vehicle_data)
+                            st.success("Imagem excluída com sucesso!")
+                            st.rerun()
+            except Exception as e:
+                st.error(f"Erro ao carregar imagem: {str(e)}")
+
+        total_cost = vehicle['purchase_price'] + vehicle['additional_costs']
+        difference = vehicle['fipe_price'] - total_cost
+
+        st.markdown(f"""
+            <div class="vehicle-info">
+            <p>🎨 <strong>Cor:</strong> {vehicle.get('color', 'Não informada')}</p>
+            <p>📊 <strong>Valor de Aquisição:</strong> R$ {vehicle['purchase_price']:.2f}</p>
+            <p>💰 <strong>Custos Adicionais:</strong> R$ {vehicle['additional_costs']:.2f}</p>
+            <p>💵 <strong>Valor Total:</strong> R$ {total_cost:.2f}</p>
+            <p>🚗 <strong>Valor FIPE:</strong> R$ {vehicle['fipe_price']:.2f}</p>
+            <p>📈 <strong>Diferença FIPE:</strong> R$ {difference:.2f}</p>
+            </div>
+        """, unsafe_allow_html=True)
 
-                with col2:
-                    if st.button(f"🗑️ Excluir", key=f"delete_{vehicle['id']}", type="primary"):
-                        st.session_state.delete_vehicle_confirmation = vehicle['id']
+        if difference > 0:
+            st.success("✅ Valor positivo em relação à FIPE")
+        else:
+            st.error("❌ Valor negativo em relação à FIPE")
+
+        if price_history:
+            st.subheader("📉 Valor FIPE x Custo Total")
+            st.line_chart(vehicle_value_vs_cost(
+                vehicle, price_history, maintenance_records
+            ))
+
+        # Adiciona seção de manutenções
+        st.subheader("📝 Histórico de Manutenções")
+        view_maintenance_history(vehicle['id'], maintenance_records)
+
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("✏️ Editar", key=f"edit_{vehicle['id']}", type="primary"):
+                st.session_state.editing_vehicle = vehicle['id']
+                st.rerun()
 
-            if st.session_state.delete_vehicle_confirmation == vehicle['id']:
-                col1, col2 = st.columns(2)
-                with col1:
-                    if st.button(f"⚠️ Confirmar", key=f"confirm_{vehicle['id']}", type="primary"):
-                        delete_vehicle(vehicle['id'])
-                        st.success("Veículo excluído com sucesso!")
-                        st.session_state.delete_vehicle_confirmation = None
-                        st.rerun()
-                with col2:
-                    if st.button("❌ Cancelar", key=f"cancel_delete_{vehicle['id']}", type="primary"):
-                        st.session_state.delete_vehicle_confirmation = None
-                        st.rerun()
+        with col2:
+            if st.button(f"🗑️ Excluir", key=f"delete_{vehicle['id']}", type="primary"):
+                st.session_state.delete_vehicle_confirmation = vehicle['id']
+
+    if st.session_state.delete_vehicle_confirmation == vehicle['id']:
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button(f"⚠️ Confirmar", key=f"confirm_{vehicle['id']}", type="primary"):
+                delete_vehicle(vehicle['id'])
+                st.success("Veículo excluído com sucesso!")
+                st.session_state.delete_vehicle_confirmation = None
+                st.rerun()
+        with col2:
+            if st.button("❌ Cancelar", key=f"cancel_delete_{vehicle['id']}", type="primary"):
+                st.session_state.delete_vehicle_confirmation = None
+                st.rerun()
+
+def view_diagnostics():
+    st.header("Diagnóstico")
+
+    if not metrics.enabled():
+        st.info("Métricas desligadas. Inicie o app com CARRO_METRICS=1 para medir banco, FIPE, imagens e telas.")
+
+    data = metrics.snapshot()
+    st.subheader("Tempos")
+    if data['timers']:
+        st.dataframe(data['timers'], use_container_width=True, hide_index=True)
+    st.subheader("Contadores")
+    if data['counters']:
+        st.dataframe(data['counters'], use_container_width=True, hide_index=True)
+
+    st.subheader("Cache FIPE")
+    st.dataframe(
+        [dict(endpoint=endpoint, **stats) for endpoint, stats in get_cache_stats().items()],
+        use_container_width=True, hide_index=True
+    )
+
+    text = metrics.prometheus_text()
+    with st.expander("Formato Prometheus"):
+        st.code(text, language=None)
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("📥 Baixar métricas", data=text, file_name="metrics.prom", mime="text/plain")
+    with col2:
+        if st.button("🔄 Zerar métricas"):
+            metrics.reset()
+            st.rerun()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,476 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import re
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+import database
+
+# Perfil de inicialização: módulos importados a frio, cada um em um interpretador novo
+STARTUP_MODULES = ('app', 'database', 'fipe_api', 'vehicle_manager', 'importer')
+# Bibliotecas pesadas que só devem carregar quando a funcionalidade é usada
+HEAVY_MODULES = ('pandas', 'numpy', 'PIL', 'requests', 'urllib3')
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+
+# Escala padrão: uma frota grande com histórico longo
+BENCH_VEHICLES = 10000
+BENCH_MAINTENANCE = 1000000
+BENCH_DB_PATH = 'bench.db'
+BENCH_SEED = 42
+BENCH_INSERT_CHUNK = 50000
+
+# Corpus de fotos do save_image: nome -> (largura, altura, formato)
+IMAGE_CORPUS = {
+    'small_jpeg': (640, 480, 'JPEG'),
+    'phone_jpeg': (4032, 3024, 'JPEG'),
+    'medium_png': (1600, 1200, 'PNG'),
+}
+
+BRANDS = {
+    'Fiat': ['Uno', 'Palio', 'Strada', 'Argo', 'Mobi', 'Toro'],
+    'Volkswagen': ['Gol', 'Polo', 'Saveiro', 'T-Cross', 'Virtus'],
+    'Chevrolet': ['Onix', 'Prisma', 'S10', 'Tracker', 'Spin'],
+    'Ford': ['Ka', 'Fiesta', 'Ranger', 'EcoSport'],
+    'Toyota': ['Corolla', 'Hilux', 'Etios', 'Yaris'],
+    'Honda': ['Civic', 'Fit', 'HR-V', 'City'],
+    'Hyundai': ['HB20', 'Creta', 'Tucson'],
+    'Renault': ['Sandero', 'Logan', 'Duster', 'Kwid'],
+}
+COLORS = ['Branco', 'Preto', 'Prata', 'Cinza', 'Vermelho', 'Azul']
+DESCRIPTIONS = [
+    'Troca de óleo', 'Alinhamento e balanceamento', 'Troca de pastilhas de freio',
+    'Revisão geral', 'Troca de pneus', 'Higienização do ar-condicionado', 'Troca de bateria',
+]
+AUTHORS = ['Felipe', 'Ana', 'Carlos', 'Oficina Central', 'Mariana']
+
+
+def _photo(rng, width, height, image_format='JPEG'):
+    # Gradiente com ruído: comprime como uma foto, não como uma cor sólida
+    image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    noise = Image.effect_noise((width, height), 40).convert('RGB')
+    image = Image.blend(image, noise, 0.3)
+    ImageDraw.Draw(image).rectangle(
+        [width // 4, height // 3, width * 3 // 4, height * 2 // 3],
+        fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+    )
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, quality=90)
+    return buffer.getvalue()
+
+
+def generate(path=BENCH_DB_PATH, vehicles=BENCH_VEHICLES, maintenance=BENCH_MAINTENANCE,
+             photos=0, seed=BENCH_SEED):
+    """
+    Create a synthetic fleet database: `vehicles` vehicles, `maintenance`
+    maintenance records spread over the last five years and, for the first
+    `photos` vehicles, a distinct photo stored with its derivatives
+    """
+    from vehicle_manager import store_vehicle_image
+
+    # Descarta o pool antes de apagar o banco e os arquivos do WAL
+    database.configure(path=path)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(f'{path}{suffix}'):
+            os.remove(f'{path}{suffix}')
+    # init_db só migra cada caminho uma vez por processo; o arquivo novo está vazio
+    database._migrated_paths.discard(database.DB_PATH)
+    database.init_db()
+    rng = random.Random(seed)
+
+    vehicle_rows = []
+    for index in range(vehicles):
+        brand = rng.choice(list(BRANDS))
+        purchase_price = rng.randrange(15000, 180000)
+        image_hash = None
+        if index < photos:
+            image_hash = store_vehicle_image(_photo(rng, 1280, 960))
+        vehicle_rows.append((
+            brand, rng.choice(BRANDS[brand]), str(rng.randrange(2005, 2025)), rng.choice(COLORS),
+            purchase_price, 0, round(purchase_price * rng.uniform(0.7, 1.3), 2), image_hash
+        ))
+    with database.transaction() as conn:
+        conn.executemany('''
+            INSERT INTO vehicles (brand, model, year, color, purchase_price, additional_costs, fipe_price, image_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', vehicle_rows)
+        vehicle_ids = [row[0] for row in conn.execute('SELECT id FROM vehicles')]
+
+    first_day = date.today() - timedelta(days=5 * 365)
+    remaining = maintenance
+    while remaining > 0:
+        chunk = min(remaining, BENCH_INSERT_CHUNK)
+        rows = [
+            (
+                rng.choice(vehicle_ids),
+                (first_day + timedelta(days=rng.randrange(5 * 365))).isoformat(),
+                rng.choice(DESCRIPTIONS),
+                round(rng.uniform(80, 3500), 2),
+                rng.randrange(1000, 250000),
+                rng.choice(AUTHORS),
+            )
+            for _ in range(chunk)
+        ]
+        with database.transaction() as conn:
+            conn.executemany('''
+                INSERT INTO maintenance (vehicle_id, date, description, cost, mileage, author)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows)
+        remaining -= chunk
+
+    # Mesmo estado que add_maintenance deixaria: custos somados no veículo
+    with database.transaction() as conn:
+        conn.execute('''
+            UPDATE vehicles SET additional_costs = COALESCE(
+                (SELECT SUM(cost) FROM maintenance WHERE maintenance.vehicle_id = vehicles.id), 0)
+        ''')
+        database._rebuild_rollups(conn.cursor())
+    database.close_db()
+
+
+def _measure(fn, repeat, setup=None):
+    timings = []
+    for i in range(repeat):
+        args = setup(i) if setup else ()
+        start = time.perf_counter()
+        fn(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    return _stats(timings)
+
+
+def _stats(timings):
+    timings = sorted(timings)
+    repeat = len(timings)
+    return {
+        'repeat': repeat,
+        'min_ms': timings[0],
+        'median_ms': statistics.median(timings),
+        'mean_ms': statistics.fmean(timings),
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'max_ms': timings[-1],
+    }
+
+
+def bench_database(path, repeat):
+    """
+    Time the database functions against a scratch copy of the generated
+    database, so the writes do not change the baseline
+    """
+    workdir = tempfile.mkdtemp(prefix='carro-bench-')
+    scratch = os.path.join(workdir, 'bench.db')
+    source = sqlite3.connect(path)
+    with sqlite3.connect(scratch) as target:
+        source.backup(target)
+    source.close()
+
+    try:
+        database.configure(path=scratch)
+        database.init_db()
+        with database.get_db() as conn:
+            vehicle_ids = [row[0] for row in conn.execute('SELECT id FROM vehicles ORDER BY id')]
+        rng = random.Random(BENCH_SEED)
+        today = date.today().isoformat()
+
+        def uncached(args=lambda i: ()):
+            # As leituras com @cached_read vão ao banco só com o cache vazio
+            def setup(i):
+                database.clear_read_cache()
+                return args(i)
+            return setup
+
+        results = {}
+        results['get_vehicles'] = _measure(database.get_vehicles, repeat, uncached())
+        results['get_vehicle_maintenance'] = _measure(
+            database.get_vehicle_maintenance, repeat * 20, uncached(lambda i: (rng.choice(vehicle_ids),))
+        )
+        # Acertos do cache de leitura, medidos à parte depois de uma chamada de aquecimento
+        database.get_vehicles()
+        database.get_vehicle_maintenance(vehicle_ids[0])
+        results['get_vehicles_cached'] = _measure(database.get_vehicles, repeat)
+        results['get_vehicle_maintenance_cached'] = _measure(
+            database.get_vehicle_maintenance, repeat * 20, lambda i: (vehicle_ids[0],)
+        )
+        results['get_all_maintenance_records'] = _measure(
+            database.get_all_maintenance_records, max(1, repeat // 2)
+        )
+        results['add_maintenance'] = _measure(
+            database.add_maintenance, repeat * 20,
+            lambda i: ({
+                'vehicle_id': rng.choice(vehicle_ids), 'date': today, 'description': 'Benchmark',
+                'cost': 100.0, 'mileage': 50000, 'author': 'benchmark'
+            },)
+        )
+        # Exclui a partir do fim para não repetir ids
+        doomed = vehicle_ids[::-1]
+        results['delete_vehicle'] = _measure(
+            database.delete_vehicle, min(len(doomed), repeat * 5), lambda i: (doomed[i],)
+        )
+        return results
+    finally:
+        database.close_db()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_images(repeat):
+    """
+    Time vehicle_manager.save_image over the photo corpus
+    """
+    from vehicle_manager import save_image
+
+    rng = random.Random(BENCH_SEED)
+    results = {}
+    for name, (width, height, image_format) in IMAGE_CORPUS.items():
+        data = _photo(rng, width, height, image_format)
+        results[f'save_image[{name}]'] = dict(
+            _measure(save_image, repeat, lambda i: (data,)), bytes=len(data)
+        )
+    return results
+
+
+def bench_fipe(repeat):
+    """
+    Time the fipe_api lookups against the in-process stand-in catalog:
+    cold (empty caches) and warm (memory cache hits)
+    """
+    import fipe_api
+    from fipe_cache import PersistentCache
+    from fipe_standin import StandinTransport, brands, models, years
+    logging.getLogger().setLevel(logging.WARNING)  # o fipe_api registra cada consulta em INFO
+
+    # Cache persistente descartável, sem tocar no cache real do usuário
+    workdir = tempfile.mkdtemp(prefix='carro-bench-fipe-')
+    user_cache = fipe_api.persistent_cache
+    fipe_api.persistent_cache = PersistentCache(os.path.join(workdir, 'fipe_cache.db'))
+    fipe_api.client = fipe_api.FipeClient(
+        transport=StandinTransport(), rate_limiter=fipe_api.RateLimiter(rate=1e9, burst=1000000)
+    )
+    rng = random.Random(BENCH_SEED)
+    lookups = []
+    for _ in range(repeat * 10):
+        brand_code = rng.choice(brands())['codigo']
+        model_code = rng.choice(models(int(brand_code)))['codigo']
+        year_code = rng.choice(years(int(brand_code), model_code))['codigo']
+        lookups.append((brand_code, model_code, year_code))
+
+    def clear():
+        for endpoint_cache in fipe_api.ENDPOINT_CACHES:
+            endpoint_cache.clear()
+        fipe_api.persistent_cache.clear()
+
+    def lookup(brand_code, model_code, year_code):
+        fipe_api.get_fipe_brands()
+        fipe_api.get_fipe_models(brand_code)
+        fipe_api.get_fipe_years(brand_code, model_code)
+        fipe_api.get_fipe_price(brand_code, model_code, year_code)
+
+    try:
+        clear()
+        results = {'fipe_lookup_cold': _measure(lookup, len(lookups), lambda i: lookups[i])}
+        results['fipe_lookup_warm'] = _measure(lookup, len(lookups), lambda i: lookups[i])
+        for endpoint_cache in fipe_api.ENDPOINT_CACHES:
+            endpoint_cache.clear()
+        results['fipe_lookup_persistent'] = _measure(lookup, len(lookups), lambda i: lookups[i])
+        return results
+    finally:
+        fipe_api.persistent_cache.close()
+        fipe_api.persistent_cache = user_cache
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def import_profile(module):
+    """
+    Import `module` in a fresh interpreter with `-X importtime` and return
+    [(name, self ms, cumulative ms, depth)] in import order; the module
+    itself is the last entry with depth 0
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    profile = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            profile.append((name, int(self_us) / 1000, int(cumulative_us) / 1000, len(indent) // 2))
+    return profile
+
+
+def _import_total(profile, module):
+    return next(cumulative for name, _, cumulative, depth in reversed(profile) if name == module and depth == 0)
+
+
+def importtime_report(module='app', top=20):
+    """
+    Lines describing a cold import of `module`: total time, which heavy
+    libraries it pulled in and the slowest imports
+    """
+    profile = import_profile(module)
+    loaded = {name for name, _, _, _ in profile}
+    lines = [f"import {module}: {_import_total(profile, module):.1f} ms"]
+    for heavy in HEAVY_MODULES:
+        cumulative = next((c for name, _, c, _ in profile if name == heavy), None)
+        status = f"carregado ({cumulative:.1f} ms)" if heavy in loaded else "não carregado"
+        lines.append(f"  {heavy:12} {status}")
+    lines.append(f"{'módulo':60} {'acumulado':>10} {'próprio':>10}")
+    for name, self_ms, cumulative, depth in sorted(profile, key=lambda entry: -entry[2])[:top]:
+        lines.append(f"{'  ' * depth + name:60} {cumulative:8.1f} ms {self_ms:8.1f} ms")
+    return lines
+
+
+def bench_startup(repeat):
+    """
+    Cold import time of the main modules (each in a fresh interpreter) and
+    the time of an app rerun (the dashboard, on an empty database)
+    """
+    results = {}
+    for module in STARTUP_MODULES:
+        results[f'startup_import[{module}]'] = _stats(
+            [_import_total(import_profile(module), module) for _ in range(repeat)]
+        )
+
+    from streamlit.testing.v1 import AppTest
+
+    workdir = tempfile.mkdtemp(prefix='carro-bench-')
+    try:
+        database.configure(path=os.path.join(workdir, 'app.db'))
+        app = AppTest.from_file(
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py'), default_timeout=60
+        )
+        app.run()  # a primeira execução paga os imports e a configuração única
+        results['startup_rerun[dashboard]'] = _measure(app.run, repeat * 4)
+        return results
+    finally:
+        database.close_db()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _scale(path):
+    with sqlite3.connect(path) as conn:
+        return {
+            'vehicles': conn.execute('SELECT COUNT(*) FROM vehicles').fetchone()[0],
+            'maintenance': conn.execute('SELECT COUNT(*) FROM maintenance').fetchone()[0],
+            'images': conn.execute('SELECT COUNT(*) FROM images').fetchone()[0],
+        }
+
+
+def run(path=BENCH_DB_PATH, repeat=5, suites=('database', 'images', 'fipe', 'startup')):
+    """
+    Run the selected suites and return the results with run metadata
+    """
+    results = {}
+    if 'database' in suites:
+        results.update(bench_database(path, repeat))
+    if 'images' in suites:
+        results.update(bench_images(repeat))
+    if 'fipe' in suites:
+        results.update(bench_fipe(repeat))
+    if 'startup' in suites:
+        results.update(bench_startup(repeat))
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sqlite': sqlite3.sqlite_version,
+            'scale': _scale(path) if 'database' in suites else None,
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current):
+    """
+    Lines comparing the median of each benchmark with a baseline run
+    """
+    lines = []
+    for name, stats in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            lines.append(f"{name:45} {stats['median_ms']:10.2f} ms   (novo)")
+            continue
+        ratio = stats['median_ms'] / before['median_ms'] if before['median_ms'] else float('inf')
+        lines.append(f"{name:45} {before['median_ms']:10.2f} -> {stats['median_ms']:10.2f} ms   x{ratio:.2f}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do banco, das imagens, da FIPE e da inicialização")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    gen = subparsers.add_parser('generate', help="gera o banco sintético")
+    gen.add_argument('--db', default=BENCH_DB_PATH)
+    gen.add_argument('--vehicles', type=int, default=BENCH_VEHICLES)
+    gen.add_argument('--maintenance', type=int, default=BENCH_MAINTENANCE)
+    gen.add_argument('--photos', type=int, default=0, help="quantos veículos recebem foto")
+    gen.add_argument('--seed', type=int, default=BENCH_SEED)
+
+    bench = subparsers.add_parser('run', help="executa os benchmarks")
+    bench.add_argument('--db', default=BENCH_DB_PATH)
+    bench.add_argument('--repeat', type=int, default=5)
+    bench.add_argument('--suite', action='append', choices=['database', 'images', 'fipe', 'startup'],
+                       help="suíte a executar (padrão: todas)")
+    bench.add_argument('--output', help="arquivo JSON com os resultados")
+    bench.add_argument('--compare', help="JSON de uma execução anterior para comparar")
+
+    profile = subparsers.add_parser('importtime', help="perfil de import a frio (python -X importtime)")
+    profile.add_argument('--module', default='app')
+    profile.add_argument('--top', type=int, default=20, help="quantos imports listar")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.command == 'generate':
+        start = time.perf_counter()
+        generate(args.db, args.vehicles, args.maintenance, args.photos, args.seed)
+        print(f"Banco {args.db} gerado em {time.perf_counter() - start:.1f}s: {_scale(args.db)}")
+        return
+
+    if args.command == 'importtime':
+        print('\n'.join(importtime_report(args.module, args.top)))
+        return
+
+    suites = args.suite or ['database', 'images', 'fipe', 'startup']
+    if 'database' in suites and not os.path.exists(args.db):
+        sys.exit(f"Banco {args.db} não encontrado; rode primeiro: python benchmark.py generate")
+
+    report = run(args.db, args.repeat, suites)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print('\n'.join(compare(json.load(f), report)))
+    else:
+        for name, stats in report['results'].items():
+            print(f"{name:45} mediana {stats['median_ms']:10.2f} ms   p95 {stats['p95_ms']:10.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,218 @@
-import sqlite3
+import base64
+import functools
+import hashlib
 import json
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from cachetools import LRUCache
+
+import metrics
+
+# Configuração do banco (pode ser sobrescrita por variáveis de ambiente ou configure())
+DB_PATH = os.environ.get('CARRO_DB_PATH', 'vehicles.db')
+DB_MMAP_SIZE = int(os.environ.get('CARRO_DB_MMAP_SIZE', 64 * 1024 * 1024))  # bytes
+DB_CACHE_SIZE = int(os.environ.get('CARRO_DB_CACHE_SIZE', -16000))  # negativo = KiB
+DB_POOL_SIZE = int(os.environ.get('CARRO_DB_POOL_SIZE', 8))
+DB_BUSY_TIMEOUT = 5.0  # segundos de espera quando outro processo está escrevendo
+DB_READ_CACHE_SIZE = int(os.environ.get('CARRO_DB_READ_CACHE_SIZE', 256))  # consultas em cache; 0 desliga
+
+
+class ConnectionPool:
+    """
+    Pool de conexões SQLite de longa duração.
+
+    Cada thread usa no máximo uma conexão por vez; chamadas aninhadas na mesma
+    thread reutilizam a conexão já emprestada, de modo que funções do módulo
+    podem ser compostas dentro de uma única transação.
+    """
+
+    def __init__(self, path, mmap_size=DB_MMAP_SIZE, cache_size=DB_CACHE_SIZE, max_idle=DB_POOL_SIZE):
+        self.path = path
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+        self._local = threading.local()
+        self._closed = False
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=DB_BUSY_TIMEOUT,
+            isolation_level=None,  # transações controladas explicitamente em transaction()
+            check_same_thread=False,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        conn.execute(f'PRAGMA cache_size={int(self.cache_size)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _checkin(self, conn):
+        if self._closed:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+
+        conn = self._checkout()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if conn.in_transaction:
+                conn.rollback()
+            self._checkin(conn)
+
+    @contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            if conn.in_transaction:
+                # Já estamos dentro de uma transação desta thread
+                yield conn
+                return
+
+            # IMMEDIATE reserva a escrita logo no início e evita deadlock entre escritores
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure(path=None, mmap_size=None, cache_size=None, pool_size=None):
+    """
+    Altera a configuração do banco e descarta o pool atual.
+    """
+    global DB_PATH, DB_MMAP_SIZE, DB_CACHE_SIZE, DB_POOL_SIZE
+    with _pool_lock:
+        if path is not None:
+            DB_PATH = str(path)
+        if mmap_size is not None:
+            DB_MMAP_SIZE = mmap_size
+        if cache_size is not None:
+            DB_CACHE_SIZE = cache_size
+        if pool_size is not None:
+            DB_POOL_SIZE = pool_size
+        _reset_pool()
+    clear_read_cache()
+
+
+def _reset_pool():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+    _pool = None
+
+
+def close_db():
+    """
+    Fecha todas as conexões ociosas do pool.
+    """
+    with _pool_lock:
+        _reset_pool()
+
+
+def get_pool():
+    global _pool
+    pool = _pool
+    if pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_PATH, DB_MMAP_SIZE, DB_CACHE_SIZE, DB_POOL_SIZE)
+            pool = _pool
+    return pool
+
 
 def get_db():
-    return sqlite3.connect('vehicles.db')
+    """
+    Empresta uma conexão do pool: `with get_db() as conn: ...`
+    Sem transação explícita; use para leituras.
+    """
+    return get_pool().connection()
+
+
+def transaction():
+    """
+    Abre uma transação de escrita: `with transaction() as conn: ...`
+    Faz commit ao sair do bloco e rollback em caso de exceção.
+    """
+    return get_pool().transaction()
+
+class SchemaVersionError(RuntimeError):
+    pass
+
+
+_migrated_paths = set()
+_migrate_lock = threading.Lock()
 
 def init_db():
-    conn = get_db()
-    c = conn.cursor()
-    
-    # Verifica se a coluna color existe
-    c.execute("PRAGMA table_info(vehicles)")
-    columns = [column[1] for column in c.fetchall()]
-    
+    """
+    Aplica as migrações pendentes, controladas por PRAGMA user_version.
+    Roda uma vez por processo e banco; nas execuções seguintes do script
+    (reruns do Streamlit) não faz nenhum acesso ao banco.
+    """
+    if DB_PATH in _migrated_paths:
+        return
+
+    with _migrate_lock:
+        if DB_PATH in _migrated_paths:
+            return
+
+        with transaction() as conn:
+            c = conn.cursor()
+            version = c.execute('PRAGMA user_version').fetchone()[0]
+            if version > SCHEMA_VERSION:
+                raise SchemaVersionError(
+                    f"Banco {DB_PATH} está na versão {version}, mas o código só conhece "
+                    f"até a versão {SCHEMA_VERSION}. Atualize a aplicação."
+                )
+
+            for migration in MIGRATIONS[version:]:
+                migration(c)
+            if version != SCHEMA_VERSION:
+                c.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+        _migrated_paths.add(DB_PATH)
+
+def _migrate_v1(c):
+    # Esquema inicial; também ajusta bancos criados antes do controle de versão
     # Cria a tabela se não existir
     c.execute('''
         CREATE TABLE IF NOT EXISTS vehicles (
@@ -23,14 +224,47 @@ def init_db():
             purchase_price REAL NOT NULL,
             additional_costs REAL NOT NULL,
             fipe_price REAL NOT NULL,
-            image_data TEXT
+            image_hash TEXT
         )
     ''')
-    
-    # Adiciona a coluna color se não existir
+
+    # Fotos ficam em tabela própria, como BLOB, identificadas pelo hash do conteúdo
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS images (
+            hash TEXT PRIMARY KEY,
+            mime_type TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            data BLOB NOT NULL
+        )
+    ''')
+
+    # Versões reduzidas (miniatura, exibição) geradas uma única vez no upload
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS image_derivatives (
+            image_hash TEXT NOT NULL,
+            variant TEXT NOT NULL,
+            mime_type TEXT NOT NULL,
+            width INTEGER NOT NULL,
+            height INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (image_hash, variant)
+        )
+    ''')
+
+    # Adiciona a coluna color se não existir (verificado após o CREATE para
+    # não tentar duplicar a coluna em um banco novo)
+    c.execute("PRAGMA table_info(vehicles)")
+    columns = [column[1] for column in c.fetchall()]
     if 'color' not in columns:
         c.execute('ALTER TABLE vehicles ADD COLUMN color TEXT')
 
+    # Bancos antigos guardavam a foto em base64 dentro de vehicles.image_data
+    if 'image_hash' not in columns:
+        c.execute('ALTER TABLE vehicles ADD COLUMN image_hash TEXT')
+    if 'image_data' in columns:
+        _migrate_base64_images(c)
+
     # Nova tabela para manutenções sem campo next_maintenance_date
     c.execute('''
         CREATE TABLE IF NOT EXISTS maintenance (
@@ -51,163 +285,894 @@ def init_db():
     if 'author' not in columns:
         c.execute('ALTER TABLE maintenance ADD COLUMN author TEXT')
 
-    conn.commit()
-    conn.close()
+def _migrate_v2(c):
+    # Índices para os caminhos de acesso usados neste módulo:
+    # histórico por veículo (vehicle_id = ? ORDER BY date DESC, também em lote)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_maintenance_vehicle_date ON maintenance (vehicle_id, date)')
+    # relatório geral (ORDER BY m.date DESC)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_maintenance_date ON maintenance (date)')
+    # coleta de imagens sem referência (vehicles.image_hash = ?)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_vehicles_image_hash ON vehicles (image_hash)')
 
-def add_vehicle(vehicle_data):
-    conn = get_db()
-    c = conn.cursor()
+def _migrate_v3(c):
+    # Índices para filtros e ordenações de query_vehicles
+    c.execute('CREATE INDEX IF NOT EXISTS idx_vehicles_brand_model ON vehicles (brand, model)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_vehicles_cost ON vehicles (purchase_price + additional_costs, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_vehicles_fipe ON vehicles (fipe_price, id)')
+    c.execute(
+        'CREATE INDEX IF NOT EXISTS idx_vehicles_margin '
+        'ON vehicles (fipe_price - (purchase_price + additional_costs), id)'
+    )
+
+def _migrate_v4(c):
+    # Totais da frota mantidos por triggers, para leitura em O(1) no painel
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS fleet_summary (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            vehicle_count INTEGER NOT NULL,
+            total_invested REAL NOT NULL,
+            total_fipe REAL NOT NULL
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_monthly (
+            month TEXT PRIMARY KEY,
+            record_count INTEGER NOT NULL,
+            total_cost REAL NOT NULL
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_by_author (
+            author TEXT PRIMARY KEY,
+            record_count INTEGER NOT NULL,
+            total_cost REAL NOT NULL
+        )
+    ''')
+
+    for statement in _ROLLUP_TRIGGERS:
+        c.execute(statement)
+    _rebuild_rollups(c)
+
+# Manutenções entram no mês AAAA-MM da data e no autor (vazio quando ausente)
+_ROLLUP_TRIGGERS = [
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_vehicles_rollup_insert AFTER INSERT ON vehicles
+    BEGIN
+        UPDATE fleet_summary SET
+            vehicle_count = vehicle_count + 1,
+            total_invested = total_invested + NEW.purchase_price + NEW.additional_costs,
+            total_fipe = total_fipe + NEW.fipe_price
+        WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_vehicles_rollup_update
+    AFTER UPDATE OF purchase_price, additional_costs, fipe_price ON vehicles
+    BEGIN
+        UPDATE fleet_summary SET
+            total_invested = total_invested
+                + (NEW.purchase_price + NEW.additional_costs)
+                - (OLD.purchase_price + OLD.additional_costs),
+            total_fipe = total_fipe + NEW.fipe_price - OLD.fipe_price
+        WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_vehicles_rollup_delete AFTER DELETE ON vehicles
+    BEGIN
+        UPDATE fleet_summary SET
+            vehicle_count = vehicle_count - 1,
+            total_invested = total_invested - (OLD.purchase_price + OLD.additional_costs),
+            total_fipe = total_fipe - OLD.fipe_price
+        WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_maintenance_rollup_insert AFTER INSERT ON maintenance
+    BEGIN
+        INSERT INTO maintenance_monthly (month, record_count, total_cost)
+        VALUES (substr(NEW.date, 1, 7), 1, NEW.cost)
+        ON CONFLICT (month) DO UPDATE SET
+            record_count = record_count + 1,
+            total_cost = total_cost + excluded.total_cost;
+        INSERT INTO maintenance_by_author (author, record_count, total_cost)
+        VALUES (COALESCE(NEW.author, ''), 1, NEW.cost)
+        ON CONFLICT (author) DO UPDATE SET
+            record_count = record_count + 1,
+            total_cost = total_cost + excluded.total_cost;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_maintenance_rollup_delete AFTER DELETE ON maintenance
+    BEGIN
+        UPDATE maintenance_monthly SET
+            record_count = record_count - 1,
+            total_cost = total_cost - OLD.cost
+        WHERE month = substr(OLD.date, 1, 7);
+        DELETE FROM maintenance_monthly WHERE month = substr(OLD.date, 1, 7) AND record_count <= 0;
+        UPDATE maintenance_by_author SET
+            record_count = record_count - 1,
+            total_cost = total_cost - OLD.cost
+        WHERE author = COALESCE(OLD.author, '');
+        DELETE FROM maintenance_by_author WHERE author = COALESCE(OLD.author, '') AND record_count <= 0;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_maintenance_rollup_update
+    AFTER UPDATE OF date, cost, author ON maintenance
+    BEGIN
+        UPDATE maintenance_monthly SET
+            record_count = record_count - 1,
+            total_cost = total_cost - OLD.cost
+        WHERE month = substr(OLD.date, 1, 7);
+        DELETE FROM maintenance_monthly WHERE month = substr(OLD.date, 1, 7) AND record_count <= 0;
+        INSERT INTO maintenance_monthly (month, record_count, total_cost)
+        VALUES (substr(NEW.date, 1, 7), 1, NEW.cost)
+        ON CONFLICT (month) DO UPDATE SET
+            record_count = record_count + 1,
+            total_cost = total_cost + excluded.total_cost;
+        UPDATE maintenance_by_author SET
+            record_count = record_count - 1,
+            total_cost = total_cost - OLD.cost
+        WHERE author = COALESCE(OLD.author, '');
+        DELETE FROM maintenance_by_author WHERE author = COALESCE(OLD.author, '') AND record_count <= 0;
+        INSERT INTO maintenance_by_author (author, record_count, total_cost)
+        VALUES (COALESCE(NEW.author, ''), 1, NEW.cost)
+        ON CONFLICT (author) DO UPDATE SET
+            record_count = record_count + 1,
+            total_cost = total_cost + excluded.total_cost;
+    END
+    ''',
+]
+
+def _rebuild_rollups(c):
+    c.execute('DELETE FROM fleet_summary')
     c.execute('''
-        INSERT INTO vehicles (brand, model, year, color, purchase_price, additional_costs, fipe_price, image_data)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        vehicle_data['brand'],
-        vehicle_data['model'],
-        vehicle_data['year'],
-        vehicle_data['color'],
-        vehicle_data['purchase_price'],
-        vehicle_data['additional_costs'],
-        vehicle_data['fipe_price'],
-        vehicle_data['image_data']
-    ))
-    conn.commit()
-    conn.close()
+        INSERT INTO fleet_summary (id, vehicle_count, total_invested, total_fipe)
+        SELECT 1, COUNT(*),
+               COALESCE(SUM(purchase_price + additional_costs), 0),
+               COALESCE(SUM(fipe_price), 0)
+        FROM vehicles
+    ''')
+    c.execute('DELETE FROM maintenance_monthly')
+    c.execute('''
+        INSERT INTO maintenance_monthly (month, record_count, total_cost)
+        SELECT substr(date, 1, 7), COUNT(*), SUM(cost) FROM maintenance GROUP BY substr(date, 1, 7)
+    ''')
+    c.execute('DELETE FROM maintenance_by_author')
+    c.execute('''
+        INSERT INTO maintenance_by_author (author, record_count, total_cost)
+        SELECT COALESCE(author, ''), COUNT(*), SUM(cost) FROM maintenance GROUP BY COALESCE(author, '')
+    ''')
+
+def _migrate_v5(c):
+    # Histórico do valor FIPE: um registro compacto por veículo e mês de
+    # referência (AAAAMM), em centavos; a chave primária atende consultas por período
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS fipe_price_history (
+            vehicle_id INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            price_cents INTEGER NOT NULL,
+            PRIMARY KEY (vehicle_id, month)
+        ) WITHOUT ROWID
+    ''')
+
+def _migrate_v6(c):
+    # Versão dos dados para o cache de leituras: os triggers a incrementam a
+    # cada escrita, inclusive de outros processos que usam o mesmo arquivo
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    c.execute('INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)')
+    for table in ('vehicles', 'maintenance', 'fipe_price_history'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            c.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS data_version_{table}_{event.lower()} AFTER {event} ON {table}
+                BEGIN
+                    UPDATE data_version SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+
+# Cada posição corresponde a uma versão do esquema (user_version = índice + 1)
+MIGRATIONS = [
+    _migrate_v1,
+    _migrate_v2,
+    _migrate_v3,
+    _migrate_v4,
+    _migrate_v5,
+    _migrate_v6,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Cache de leituras entre reruns: (banco, função, argumentos) -> (versão dos dados, resultado)
+_read_cache = LRUCache(maxsize=max(1, DB_READ_CACHE_SIZE))
+_read_cache_lock = threading.Lock()
+
+def get_data_version():
+    """
+    Contador incrementado a cada escrita em veículos, manutenções ou histórico FIPE.
+    """
+    with get_db() as conn:
+        return conn.execute('SELECT version FROM data_version WHERE id = 1').fetchone()[0]
+
+def _freeze(value):
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+def cached_read(fn):
+    """
+    Guarda o resultado de uma leitura até a próxima escrita no banco.
+    Cada chamada só consulta a versão dos dados (uma linha); o resultado é
+    compartilhado entre chamadas e não deve ser alterado por quem o recebe.
+    """
+    if DB_READ_CACHE_SIZE <= 0:
+        return fn
 
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = (DB_PATH, fn.__name__, _freeze(args), _freeze(sorted(kwargs.items())))
+        # A versão é lida antes da consulta: uma escrita no meio só invalida antes da hora
+        version = get_data_version()
+        with _read_cache_lock:
+            entry = _read_cache.get(key)
+        if entry is not None and entry[0] == version:
+            metrics.increment('db_read_cache', 'hit')
+            return entry[1]
+
+        metrics.increment('db_read_cache', 'miss')
+        value = fn(*args, **kwargs)
+        with _read_cache_lock:
+            _read_cache[key] = (version, value)
+        return value
+    return wrapper
+
+def clear_read_cache():
+    with _read_cache_lock:
+        _read_cache.clear()
+
+def _migrate_base64_images(c):
+    # Converte uma foto por vez para não carregar todas em memória
+    vehicle_ids = [row[0] for row in c.execute(
+        'SELECT id FROM vehicles WHERE image_data IS NOT NULL AND image_hash IS NULL'
+    ).fetchall()]
+    for vehicle_id in vehicle_ids:
+        image_data = c.execute('SELECT image_data FROM vehicles WHERE id = ?', (vehicle_id,)).fetchone()[0]
+        try:
+            image_bytes = base64.b64decode(image_data)
+        except ValueError:
+            # Mantém o valor original se não for base64 válido
+            continue
+        image_hash = _store_image(c, image_bytes)
+        c.execute(
+            'UPDATE vehicles SET image_hash = ?, image_data = NULL WHERE id = ?',
+            (image_hash, vehicle_id)
+        )
+
+# Funções para gerenciar imagens
+def _store_image(c, image_bytes, mime_type='image/jpeg'):
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    # Uploads idênticos são gravados uma única vez
+    c.execute(
+        'INSERT OR IGNORE INTO images (hash, mime_type, size, data) VALUES (?, ?, ?, ?)',
+        (image_hash, mime_type, len(image_bytes), sqlite3.Binary(image_bytes))
+    )
+    return image_hash
+
+def _store_derivatives(c, image_hash, derivatives):
+    c.executemany('''
+        INSERT OR IGNORE INTO image_derivatives (image_hash, variant, mime_type, width, height, size, data)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (image_hash, variant, mime_type, width, height, len(data), sqlite3.Binary(data))
+        for variant, (data, mime_type, width, height) in derivatives.items()
+    ])
+
+def _release_image(c, image_hash):
+    # Remove a imagem quando nenhum veículo a referencia mais
+    if image_hash and not c.execute('SELECT 1 FROM vehicles WHERE image_hash = ?', (image_hash,)).fetchone():
+        c.execute('DELETE FROM image_derivatives WHERE image_hash = ?', (image_hash,))
+        c.execute('DELETE FROM images WHERE hash = ?', (image_hash,))
+
+def store_image(image_bytes, mime_type='image/jpeg', derivatives=None):
+    """
+    Grava os bytes da imagem e retorna o hash usado como referência no veículo.
+    `derivatives` mapeia o nome da variante para (data, mime_type, width, height).
+    """
+    if image_bytes is None:
+        return None
+    with transaction() as conn:
+        c = conn.cursor()
+        image_hash = _store_image(c, image_bytes, mime_type)
+        if derivatives:
+            _store_derivatives(c, image_hash, derivatives)
+        return image_hash
+
+def attach_vehicle_images(images):
+    """
+    Grava várias fotos e as associa aos veículos em uma única transação.
+    `images` é uma lista de (vehicle_id, image_bytes, mime_type, derivatives);
+    as fotos substituídas são liberadas. Retorna quantos veículos foram atualizados.
+    """
+    updated = 0
+    with transaction() as conn:
+        c = conn.cursor()
+        for vehicle_id, image_bytes, mime_type, derivatives in images:
+            row = c.execute('SELECT image_hash FROM vehicles WHERE id = ?', (vehicle_id,)).fetchone()
+            if row is None:
+                continue
+            image_hash = _store_image(c, image_bytes, mime_type)
+            _store_derivatives(c, image_hash, derivatives)
+            c.execute('UPDATE vehicles SET image_hash = ? WHERE id = ?', (image_hash, vehicle_id))
+            if row['image_hash'] != image_hash:
+                _release_image(c, row['image_hash'])
+            updated += 1
+    return updated
+
+def store_image_derivatives(image_hash, derivatives):
+    with transaction() as conn:
+        _store_derivatives(conn.cursor(), image_hash, derivatives)
+
+def get_images_missing_derivatives(variants):
+    """
+    Retorna os hashes das imagens que ainda não têm todas as variantes indicadas.
+    """
+    placeholders = ', '.join('?' for _ in variants)
+    with get_db() as conn:
+        c = conn.execute(f'''
+            SELECT i.hash
+            FROM images i
+            WHERE (
+                SELECT COUNT(*) FROM image_derivatives d
+                WHERE d.image_hash = i.hash AND d.variant IN ({placeholders})
+            ) < ?
+        ''', (*variants, len(variants)))
+        return [row['hash'] for row in c.fetchall()]
+
+def get_image(image_hash):
+    if not image_hash:
+        return None
+    with get_db() as conn:
+        row = conn.execute('SELECT data FROM images WHERE hash = ?', (image_hash,)).fetchone()
+        return bytes(row['data']) if row else None
+
+def get_image_variant(image_hash, variant):
+    """
+    Bytes e tipo de uma derivada ('thumb', 'display') ou do original
+    ('original'): {'data': ..., 'mime_type': ...}, ou None se não existir.
+    """
+    if not image_hash:
+        return None
+    with get_db() as conn:
+        if variant == 'original':
+            row = conn.execute('SELECT data, mime_type FROM images WHERE hash = ?', (image_hash,)).fetchone()
+        else:
+            row = conn.execute(
+                'SELECT data, mime_type FROM image_derivatives WHERE image_hash = ? AND variant = ?',
+                (image_hash, variant)
+            ).fetchone()
+        return {'data': bytes(row['data']), 'mime_type': row['mime_type']} if row else None
+
+def get_image_hashes():
+    with get_db() as conn:
+        return {row[0] for row in conn.execute('SELECT hash FROM images')}
+
+def get_vehicle_image(vehicle_id, max_size=None):
+    """
+    Carrega os bytes da foto do veículo apenas quando ela for exibida.
+    Com `max_size` (em pixels), retorna a menor derivada que cobre esse tamanho;
+    sem ele, ou se não houver derivadas, retorna o original.
+    """
+    with get_db() as conn:
+        if max_size is not None:
+            row = conn.execute('''
+                SELECT d.data
+                FROM vehicles v
+                JOIN image_derivatives d ON d.image_hash = v.image_hash
+                WHERE v.id = ?
+                ORDER BY
+                    MAX(d.width, d.height) < ?,
+                    CASE WHEN MAX(d.width, d.height) >= ? THEN MAX(d.width, d.height)
+                         ELSE -MAX(d.width, d.height) END
+                LIMIT 1
+            ''', (vehicle_id, max_size, max_size)).fetchone()
+            if row:
+                return bytes(row['data'])
+
+        row = conn.execute('''
+            SELECT i.data
+            FROM vehicles v
+            JOIN images i ON i.hash = v.image_hash
+            WHERE v.id = ?
+        ''', (vehicle_id,)).fetchone()
+        return bytes(row['data']) if row else None
+
+# Funções para gerenciar veículos
+VEHICLE_COLUMNS = 'id, brand, model, year, color, purchase_price, additional_costs, fipe_price, image_hash'
+
+def add_vehicle(vehicle_data):
+    with transaction() as conn:
+        c = conn.cursor()
+        c.execute('''
+            INSERT INTO vehicles (brand, model, year, color, purchase_price, additional_costs, fipe_price, image_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            vehicle_data['brand'],
+            vehicle_data['model'],
+            vehicle_data['year'],
+            vehicle_data['color'],
+            vehicle_data['purchase_price'],
+            vehicle_data['additional_costs'],
+            vehicle_data['fipe_price'],
+            vehicle_data.get('image_hash')
+        ))
+
+        if vehicle_data.get('fipe_month'):
+            _record_fipe_prices(c, [(c.lastrowid, vehicle_data['fipe_price'], vehicle_data['fipe_month'])])
+
+def add_vehicles(batches, progress=None):
+    """
+    Insere veículos em lote: `batches` é um iterável de listas de dicts no
+    formato de add_vehicle. Tudo roda em uma única transação; qualquer erro,
+    inclusive vindo do próprio iterável, desfaz a importação inteira.
+    `progress(total)` é chamado após cada lote. Retorna a quantidade inserida.
+    """
+    total = 0
+    with transaction() as conn:
+        c = conn.cursor()
+        for batch in batches:
+            if not batch:
+                continue
+            c.executemany('''
+                INSERT INTO vehicles (brand, model, year, color, purchase_price, additional_costs, fipe_price, image_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [
+                (vehicle['brand'], vehicle['model'], vehicle['year'], vehicle['color'],
+                 vehicle['purchase_price'], vehicle['additional_costs'], vehicle['fipe_price'],
+                 vehicle.get('image_hash'))
+                for vehicle in batch
+            ])
+
+            # Com a transação aberta, os ids do lote são sequenciais e terminam no maior id
+            last_id = c.execute('SELECT MAX(id) FROM vehicles').fetchone()[0]
+            first_id = last_id - len(batch) + 1
+            _record_fipe_prices(c, [
+                (first_id + index, vehicle['fipe_price'], vehicle.get('fipe_month'))
+                for index, vehicle in enumerate(batch)
+            ])
+
+            total += len(batch)
+            if progress:
+                progress(total)
+    return total
+
+@cached_read
 def get_vehicles():
-    conn = get_db()
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute('SELECT * FROM vehicles')
-    vehicles = [dict(row) for row in c.fetchall()]
-    conn.close()
-    return vehicles
+    with get_db() as conn:
+        c = conn.execute(f'SELECT {VEHICLE_COLUMNS} FROM vehicles')
+        return [dict(row) for row in c.fetchall()]
+
+# Expressões de ordenação aceitas por query_vehicles (as mesmas dos índices da migração 3)
+VEHICLE_SORTS = {
+    'id': 'id',
+    'cost': 'purchase_price + additional_costs',
+    'fipe': 'fipe_price',
+    'margin': 'fipe_price - (purchase_price + additional_costs)',
+}
+
+@cached_read
+def get_vehicle_brands():
+    with get_db() as conn:
+        c = conn.execute('SELECT DISTINCT brand FROM vehicles ORDER BY brand')
+        return [row['brand'] for row in c.fetchall()]
+
+@cached_read
+def get_vehicle_models(brand):
+    """
+    Modelos já cadastrados de uma marca, do mais frequente ao menos frequente.
+    """
+    with get_db() as conn:
+        c = conn.execute('''
+            SELECT model FROM vehicles WHERE brand = ?
+            GROUP BY model ORDER BY COUNT(*) DESC, model
+        ''', (brand,))
+        return [row['model'] for row in c.fetchall()]
+
+@cached_read
+def query_vehicles(search=None, brand=None, model=None, year_from=None, year_to=None,
+                   fipe_difference=None, sort='id', descending=False, limit=20, cursor=None):
+    """
+    Lista veículos com filtros, ordenação e paginação por cursor (keyset).
+
+    `fipe_difference` aceita 'positive' ou 'negative'. `cursor` é o valor
+    retornado pela página anterior. Retorna (veículos, próximo cursor ou None).
+    """
+    if sort not in VEHICLE_SORTS:
+        raise ValueError(f"Ordenação inválida: {sort}")
+    sort_expr = VEHICLE_SORTS[sort]
+    margin_expr = VEHICLE_SORTS['margin']
+
+    where = []
+    params = []
+    if search:
+        where.append("(brand || ' ' || model) LIKE ?")
+        params.append(f"%{search}%")
+    if brand:
+        where.append('brand = ?')
+        params.append(brand)
+    if model:
+        where.append('model = ?')
+        params.append(model)
+    # O ano é texto como "2015 Gasolina"; o CAST usa apenas o número inicial
+    if year_from is not None:
+        where.append('CAST(year AS INTEGER) >= ?')
+        params.append(year_from)
+    if year_to is not None:
+        where.append('CAST(year AS INTEGER) <= ?')
+        params.append(year_to)
+    if fipe_difference == 'positive':
+        where.append(f'{margin_expr} > 0')
+    elif fipe_difference == 'negative':
+        where.append(f'{margin_expr} <= 0')
+    if cursor is not None:
+        # A comparação simples na frente deixa o SQLite buscar no índice
+        # (SEARCH) em vez de percorrê-lo inteiro; a de tupla desempata pelo id
+        seek = '<' if descending else '>'
+        where.append(f'{sort_expr} {seek}= ?')
+        where.append(f'({sort_expr}, id) {seek} (?, ?)')
+        params.append(cursor[0])
+        params.extend(cursor)
+
+    direction = 'DESC' if descending else 'ASC'
+    sql = f'SELECT {VEHICLE_COLUMNS}, {sort_expr} AS sort_key FROM vehicles'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += f' ORDER BY {sort_expr} {direction}, id {direction} LIMIT ?'
+    # Busca um registro a mais para saber se existe próxima página
+    params.append(limit + 1)
+
+    with get_db() as conn:
+        rows = conn.execute(sql, params).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (rows[-1]['sort_key'], rows[-1]['id'])
+
+    vehicles = []
+    for row in rows:
+        vehicle = dict(row)
+        del vehicle['sort_key']
+        vehicles.append(vehicle)
+    return vehicles, next_cursor
 
 def update_vehicle(vehicle_id, vehicle_data):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute('''
-        UPDATE vehicles
-        SET brand=?, model=?, year=?, color=?, purchase_price=?, additional_costs=?, fipe_price=?, image_data=?
-        WHERE id=?
-    ''', (
-        vehicle_data['brand'],
-        vehicle_data['model'],
-        vehicle_data['year'],
-        vehicle_data['color'],
-        vehicle_data['purchase_price'],
-        vehicle_data['additional_costs'],
-        vehicle_data['fipe_price'],
-        vehicle_data['image_data'],
-        vehicle_id
-    ))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        c = conn.cursor()
+        row = c.execute('SELECT image_hash FROM vehicles WHERE id = ?', (vehicle_id,)).fetchone()
+        old_hash = row['image_hash'] if row else None
+
+        c.execute('''
+            UPDATE vehicles
+            SET brand=?, model=?, year=?, color=?, purchase_price=?, additional_costs=?, fipe_price=?, image_hash=?
+            WHERE id=?
+        ''', (
+            vehicle_data['brand'],
+            vehicle_data['model'],
+            vehicle_data['year'],
+            vehicle_data['color'],
+            vehicle_data['purchase_price'],
+            vehicle_data['additional_costs'],
+            vehicle_data['fipe_price'],
+            vehicle_data.get('image_hash'),
+            vehicle_id
+        ))
+
+        if old_hash != vehicle_data.get('image_hash'):
+            _release_image(c, old_hash)
+
+        if vehicle_data.get('fipe_month'):
+            _record_fipe_prices(c, [(vehicle_id, vehicle_data['fipe_price'], vehicle_data['fipe_month'])])
+
+def update_fipe_prices(prices):
+    """
+    Atualiza o valor FIPE de vários veículos em uma única transação e
+    registra o histórico. `prices` é uma sequência de
+    (vehicle_id, fipe_price, month), com month no formato AAAAMM.
+    """
+    prices = list(prices)
+    with transaction() as conn:
+        c = conn.cursor()
+        c.executemany(
+            'UPDATE vehicles SET fipe_price = ? WHERE id = ?',
+            [(fipe_price, vehicle_id) for vehicle_id, fipe_price, _ in prices]
+        )
+        _record_fipe_prices(c, prices)
 
 def delete_vehicle(vehicle_id):
-    conn = get_db()
-    c = conn.cursor()
-    
-    # Primeiro, exclui todas as manutenções associadas ao veículo
-    c.execute('DELETE FROM maintenance WHERE vehicle_id = ?', (vehicle_id,))
-    
-    # Em seguida, exclui o veículo
-    c.execute('DELETE FROM vehicles WHERE id = ?', (vehicle_id,))
-    
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        c = conn.cursor()
+        row = c.execute('SELECT image_hash FROM vehicles WHERE id = ?', (vehicle_id,)).fetchone()
+
+        # Primeiro, exclui todas as manutenções associadas ao veículo
+        c.execute('DELETE FROM maintenance WHERE vehicle_id = ?', (vehicle_id,))
+
+        c.execute('DELETE FROM fipe_price_history WHERE vehicle_id = ?', (vehicle_id,))
+
+        # Em seguida, exclui o veículo
+        c.execute('DELETE FROM vehicles WHERE id = ?', (vehicle_id,))
+
+        if row:
+            _release_image(c, row['image_hash'])
 
 # Funções para gerenciar manutenções
 def add_maintenance(maintenance_data):
-    conn = get_db()
-    c = conn.cursor()
-    
-    # Adiciona a manutenção sem next_maintenance_date
-    c.execute('''
-        INSERT INTO maintenance (vehicle_id, date, description, cost, mileage, author)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (
-        maintenance_data['vehicle_id'],
-        maintenance_data['date'],
-        maintenance_data['description'],
-        maintenance_data['cost'],
-        maintenance_data['mileage'],
-        maintenance_data['author']
-    ))
-    
-    # Atualiza os custos adicionais do veículo
-    c.execute('''
-        UPDATE vehicles
-        SET additional_costs = additional_costs + ?
-        WHERE id = ?
-    ''', (
-        maintenance_data['cost'],
-        maintenance_data['vehicle_id']
-    ))
-    
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        c = conn.cursor()
+
+        # Adiciona a manutenção sem next_maintenance_date
+        c.execute('''
+            INSERT INTO maintenance (vehicle_id, date, description, cost, mileage, author)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            maintenance_data['vehicle_id'],
+            maintenance_data['date'],
+            maintenance_data['description'],
+            maintenance_data['cost'],
+            maintenance_data['mileage'],
+            maintenance_data['author']
+        ))
 
+        # Atualiza os custos adicionais do veículo
+        c.execute('''
+            UPDATE vehicles
+            SET additional_costs = additional_costs + ?
+            WHERE id = ?
+        ''', (
+            maintenance_data['cost'],
+            maintenance_data['vehicle_id']
+        ))
+
+def add_maintenance_records(batches, progress=None):
+    """
+    Insere manutenções em lote: `batches` é um iterável de listas de dicts no
+    formato de add_maintenance. Tudo roda em uma única transação; qualquer
+    erro, inclusive vindo do próprio iterável, desfaz a importação inteira.
+    `progress(total)` é chamado após cada lote. Retorna a quantidade inserida.
+    """
+    total = 0
+    with transaction() as conn:
+        c = conn.cursor()
+        for batch in batches:
+            if not batch:
+                continue
+            c.executemany('''
+                INSERT INTO maintenance (vehicle_id, date, description, cost, mileage, author)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [
+                (record['vehicle_id'], record['date'], record['description'],
+                 record['cost'], record['mileage'], record['author'])
+                for record in batch
+            ])
+
+            # Custos adicionais: uma atualização por veículo do lote
+            costs = {}
+            for record in batch:
+                costs[record['vehicle_id']] = costs.get(record['vehicle_id'], 0) + record['cost']
+            c.executemany(
+                'UPDATE vehicles SET additional_costs = additional_costs + ? WHERE id = ?',
+                [(cost, vehicle_id) for vehicle_id, cost in costs.items()]
+            )
+
+            total += len(batch)
+            if progress:
+                progress(total)
+    return total
+
+@cached_read
 def get_vehicle_maintenance(vehicle_id):
-    conn = get_db()
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute('SELECT * FROM maintenance WHERE vehicle_id = ? ORDER BY date DESC', (vehicle_id,))
-    maintenance_records = [dict(row) for row in c.fetchall()]
-    conn.close()
-    return maintenance_records
+    with get_db() as conn:
+        c = conn.execute('SELECT * FROM maintenance WHERE vehicle_id = ? ORDER BY date DESC', (vehicle_id,))
+        return [dict(row) for row in c.fetchall()]
+
+@cached_read
+def get_maintenance_by_vehicles(vehicle_ids):
+    """
+    Carrega em uma única consulta as manutenções de vários veículos,
+    agrupadas por vehicle_id (cada lista ordenada por data decrescente).
+    """
+    vehicle_ids = list(vehicle_ids)
+    maintenance_by_vehicle = {vehicle_id: [] for vehicle_id in vehicle_ids}
+    if not vehicle_ids:
+        return maintenance_by_vehicle
+
+    with get_db() as conn:
+        # json_each evita o limite de parâmetros do SQLite para listas grandes
+        c = conn.execute('''
+            SELECT * FROM maintenance
+            WHERE vehicle_id IN (SELECT value FROM json_each(?))
+            ORDER BY vehicle_id, date DESC
+        ''', (json.dumps(vehicle_ids),))
+        for row in c:
+            maintenance_by_vehicle[row['vehicle_id']].append(dict(row))
+    return maintenance_by_vehicle
 
 def update_maintenance(maintenance_id, maintenance_data):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute('''
-        UPDATE maintenance
-        SET date=?, description=?, cost=?, mileage=?, author=?
-        WHERE id=?
-    ''', (
-        maintenance_data['date'],
-        maintenance_data['description'],
-        maintenance_data['cost'],
-        maintenance_data['mileage'],
-        maintenance_data['author'],
-        maintenance_id
-    ))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        c = conn.cursor()
+        c.execute('''
+            UPDATE maintenance
+            SET date=?, description=?, cost=?, mileage=?, author=?
+            WHERE id=?
+        ''', (
+            maintenance_data['date'],
+            maintenance_data['description'],
+            maintenance_data['cost'],
+            maintenance_data['mileage'],
+            maintenance_data['author'],
+            maintenance_id
+        ))
 
 def delete_maintenance(maintenance_id):
-    conn = get_db()
-    c = conn.cursor()
-    
-    # Primeiro obtém os dados da manutenção antes de excluí-la
-    c.execute('SELECT vehicle_id, cost FROM maintenance WHERE id = ?', (maintenance_id,))
-    maintenance = c.fetchone()
-    
-    if maintenance:
-        vehicle_id, maintenance_cost = maintenance
-        
-        # Remove a manutenção
-        c.execute('DELETE FROM maintenance WHERE id = ?', (maintenance_id,))
-        
-        # Atualiza os custos adicionais do veículo subtraindo o custo da manutenção
-        c.execute('''
-            UPDATE vehicles
-            SET additional_costs = additional_costs - ?
-            WHERE id = ?
-        ''', (maintenance_cost, vehicle_id))
-        
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        c = conn.cursor()
+
+        # Primeiro obtém os dados da manutenção antes de excluí-la
+        c.execute('SELECT vehicle_id, cost FROM maintenance WHERE id = ?', (maintenance_id,))
+        maintenance = c.fetchone()
+
+        if maintenance:
+            vehicle_id, maintenance_cost = maintenance
+
+            # Remove a manutenção
+            c.execute('DELETE FROM maintenance WHERE id = ?', (maintenance_id,))
+
+            # Atualiza os custos adicionais do veículo subtraindo o custo da manutenção
+            c.execute('''
+                UPDATE vehicles
+                SET additional_costs = additional_costs - ?
+                WHERE id = ?
+            ''', (maintenance_cost, vehicle_id))
 
 def get_all_maintenance_records():
-    conn = get_db()
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute('''
+    with get_db() as conn:
+        c = conn.execute('''
+            SELECT m.*, v.brand, v.model, v.year
+            FROM maintenance m
+            JOIN vehicles v ON m.vehicle_id = v.id
+            ORDER BY m.date DESC
+        ''')
+        return [dict(row) for row in c.fetchall()]
+
+def iter_maintenance_records(date_from=None, date_to=None, vehicle_ids=None, chunk_size=500):
+    """
+    Percorre as manutenções (com marca/modelo/ano) em blocos de `chunk_size`
+    linhas, sem carregar o histórico inteiro em memória.
+    Datas no formato 'AAAA-MM-DD'; os limites são inclusivos.
+    """
+    where = []
+    params = []
+    if date_from:
+        where.append('m.date >= ?')
+        params.append(date_from)
+    if date_to:
+        where.append('m.date <= ?')
+        params.append(date_to)
+    if vehicle_ids:
+        where.append('m.vehicle_id IN (SELECT value FROM json_each(?))')
+        params.append(json.dumps(list(vehicle_ids)))
+
+    sql = '''
         SELECT m.*, v.brand, v.model, v.year
         FROM maintenance m
         JOIN vehicles v ON m.vehicle_id = v.id
-        ORDER BY m.date DESC
-    ''')
-    maintenance_records = [dict(row) for row in c.fetchall()]
-    conn.close()
-    return maintenance_records
+    '''
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY m.date DESC'
+
+    with get_db() as conn:
+        c = conn.execute(sql, params)
+        while True:
+            rows = c.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+@cached_read
+def get_vehicle_labels():
+    """
+    Retorna {id: "Marca Modelo (Ano)"} sem carregar os demais campos.
+    """
+    with get_db() as conn:
+        c = conn.execute('SELECT id, brand, model, year FROM vehicles ORDER BY brand, model, id')
+        return {row['id']: f"{row['brand']} {row['model']} ({row['year']})" for row in c.fetchall()}
+
+# Funções para os totais da frota (tabelas mantidas pelos triggers da migração 4)
+def rebuild_rollups():
+    """
+    Recalcula os totais a partir das tabelas de origem (correção de deriva).
+    """
+    with transaction() as conn:
+        c = conn.cursor()
+        _rebuild_rollups(c)
+        # Os totais mudam sem escrita nas tabelas de origem
+        c.execute('UPDATE data_version SET version = version + 1 WHERE id = 1')
+
+@cached_read
+def get_fleet_summary():
+    with get_db() as conn:
+        row = conn.execute('''
+            SELECT vehicle_count, total_invested, total_fipe, total_fipe - total_invested AS margin
+            FROM fleet_summary WHERE id = 1
+        ''').fetchone()
+        return dict(row) if row else {'vehicle_count': 0, 'total_invested': 0.0, 'total_fipe': 0.0, 'margin': 0.0}
+
+@cached_read
+def get_maintenance_cost_by_month():
+    with get_db() as conn:
+        c = conn.execute('SELECT month, record_count, total_cost FROM maintenance_monthly ORDER BY month')
+        return [dict(row) for row in c.fetchall()]
+
+@cached_read
+def get_maintenance_cost_by_author():
+    with get_db() as conn:
+        c = conn.execute('SELECT author, record_count, total_cost FROM maintenance_by_author ORDER BY total_cost DESC')
+        return [dict(row) for row in c.fetchall()]
+
+# Funções para o histórico de valores FIPE
+def _record_fipe_prices(c, prices):
+    # Um registro por veículo e mês; uma nova consulta no mesmo mês substitui o valor
+    c.executemany(
+        'INSERT OR REPLACE INTO fipe_price_history (vehicle_id, month, price_cents) VALUES (?, ?, ?)',
+        [(vehicle_id, month, round(fipe_price * 100)) for vehicle_id, fipe_price, month in prices if month]
+    )
+
+@cached_read
+def get_price_history(vehicle_ids, month_from=None, month_to=None):
+    """
+    Retorna (vehicle_id, month, price_cents) dos veículos indicados,
+    ordenado por veículo e mês. Meses no formato AAAAMM, limites inclusivos.
+    """
+    vehicle_ids = list(vehicle_ids)
+    if not vehicle_ids:
+        return []
+    with get_db() as conn:
+        c = conn.execute('''
+            SELECT vehicle_id, month, price_cents
+            FROM fipe_price_history
+            WHERE vehicle_id IN (SELECT value FROM json_each(?))
+              AND month BETWEEN ? AND ?
+            ORDER BY vehicle_id, month
+        ''', (json.dumps(vehicle_ids), month_from or 0, month_to or 999999))
+        return [tuple(row) for row in c.fetchall()]
+
+@cached_read
+def get_model_price_history(brand, model=None, month_from=None, month_to=None):
+    """
+    Valor FIPE médio por mês dos veículos de uma marca (e modelo):
+    lista de (month, avg_price_cents, vehicle_count).
+    """
+    sql = '''
+        SELECT h.month, AVG(h.price_cents), COUNT(*)
+        FROM vehicles v
+        JOIN fipe_price_history h ON h.vehicle_id = v.id
+        WHERE v.brand = ? AND h.month BETWEEN ? AND ?
+    '''
+    params = [brand, month_from or 0, month_to or 999999]
+    if model:
+        sql += ' AND v.model = ?'
+        params.append(model)
+    sql += ' GROUP BY h.month ORDER BY h.month'
+    with get_db() as conn:
+        return [tuple(row) for row in conn.execute(sql, params).fetchall()]
+
+
+# Instrumentação: cronometra cada função de acesso a dados (nada muda com CARRO_METRICS desligado)
+metrics.instrument(globals(), 'db_query', exclude=(
+    'configure', 'close_db', 'get_pool', 'get_db', 'transaction', 'iter_maintenance_records',
+    'cached_read', 'get_data_version', 'clear_read_cache'
+))
@@ -0,0 +1,84 @@
+from database import get_price_history, get_model_price_history
+
+# O pandas (~0,4 s de import) é importado dentro das funções: só carrega
+# quando um gráfico é montado
+
+
+def _month_labels(months):
+    # AAAAMM -> "AAAA-MM"
+    import pandas as pd
+
+    months = pd.Series(months, dtype='int64')
+    return (months // 100).astype(str) + '-' + (months % 100).astype(str).str.zfill(2)
+
+
+def depreciation_series(history):
+    """
+    Build the depreciation of each vehicle from rows of
+    (vehicle_id, month, price_cents): price and depreciation relative to the
+    first snapshot, computed for all vehicles at once
+    """
+    import pandas as pd
+
+    df = pd.DataFrame.from_records(history, columns=['vehicle_id', 'month', 'price_cents'])
+    df['price'] = df['price_cents'] / 100
+    first_price = df.groupby('vehicle_id')['price'].transform('first')
+    df['depreciation'] = 1 - df['price'] / first_price
+    df['month_label'] = _month_labels(df['month'])
+    return df.drop(columns='price_cents')
+
+
+def vehicle_value_vs_cost(vehicle, history, maintenance_records):
+    """
+    Monthly FIPE value and total cost (purchase + costs, with maintenance
+    counted from the month it happened) of a single vehicle, indexed by month
+    """
+    import pandas as pd
+
+    values = depreciation_series(history).set_index('month')['price']
+    if values.empty:
+        return pd.DataFrame(columns=['Valor FIPE', 'Custo Total'])
+
+    maintenance = pd.DataFrame.from_records(maintenance_records, columns=['date', 'cost'])
+    maintenance_total = maintenance['cost'].sum()
+    maintenance['month'] = pd.to_numeric(maintenance['date'].str.slice(0, 7).str.replace('-', ''))
+    cumulative = maintenance.groupby('month')['cost'].sum().cumsum()
+
+    # Custos fora das manutenções registradas entram desde o início
+    base_cost = vehicle['purchase_price'] + vehicle['additional_costs'] - maintenance_total
+    months = values.index.union(cumulative.index)
+    cost = base_cost + cumulative.reindex(months).ffill().fillna(0)
+
+    df = pd.DataFrame({
+        'Valor FIPE': values.reindex(months).ffill(),
+        'Custo Total': cost,
+    })
+    df.index = _month_labels(df.index)
+    return df.dropna()
+
+
+def model_depreciation(brand, model=None, month_from=None, month_to=None):
+    """
+    Average FIPE value per month of a brand (and model) and its depreciation
+    relative to the first month with data
+    """
+    import pandas as pd
+
+    df = pd.DataFrame.from_records(
+        get_model_price_history(brand, model, month_from, month_to),
+        columns=['month', 'avg_price_cents', 'vehicle_count']
+    )
+    df['price'] = df['avg_price_cents'] / 100
+    df['depreciation'] = 1 - df['price'] / df['price'].iloc[0] if not df.empty else []
+    df['month_label'] = _month_labels(df['month'])
+    return df.drop(columns='avg_price_cents')
+
+
+def vehicles_price_history(vehicle_ids, month_from=None, month_to=None):
+    """
+    Load the price history of several vehicles in one query, grouped by vehicle
+    """
+    history = {vehicle_id: [] for vehicle_id in vehicle_ids}
+    for row in get_price_history(vehicle_ids, month_from, month_to):
+        history[row[0]].append(row)
+    return history
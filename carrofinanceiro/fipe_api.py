@@ -1,10 +1,15 @@
-import requests
-import pandas as pd
+import os
 import logging
-from cachetools import TTLCache, cached
-from time import sleep
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from cachetools import TTLCache
+
+import metrics
+from fipe_cache import FIPE_CACHE_PATH, EndpointCache, PersistentCache
+from fipe_index import Catalog, IndexCache
+from fipe_transport import LiveTransport, RecordingTransport, ReplayTransport
 
 # Configuração do logger com mais detalhes
 logging.basicConfig(
@@ -13,13 +18,58 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-BASE_URL = "https://parallelum.com.br/fipe/api/v1/carros"
+BASE_URL = os.environ.get('CARRO_FIPE_BASE_URL', "https://parallelum.com.br/fipe/api/v1/carros")
+
+# Configuração do cliente HTTP (timeout em segundos, limite em requisições/segundo)
+FIPE_TIMEOUT = float(os.environ.get('CARRO_FIPE_TIMEOUT', 5))
+FIPE_RATE_LIMIT = float(os.environ.get('CARRO_FIPE_RATE_LIMIT', 5))
+FIPE_RATE_BURST = int(os.environ.get('CARRO_FIPE_RATE_BURST', 10))
+FIPE_POOL_SIZE = int(os.environ.get('CARRO_FIPE_POOL_SIZE', 10))
+
+# Transporte: live (HTTP), record (HTTP gravando em fixture) ou replay (só a fixture)
+FIPE_TRANSPORT = os.environ.get('CARRO_FIPE_TRANSPORT', 'live')
+FIPE_FIXTURE = os.environ.get('CARRO_FIPE_FIXTURE', 'fipe_fixture.json')
+FIPE_REPLAY_LATENCY = float(os.environ.get('CARRO_FIPE_REPLAY_LATENCY', 0))  # segundos
+FIPE_REPLAY_ERROR_RATE = float(os.environ.get('CARRO_FIPE_REPLAY_ERROR_RATE', 0))
+
+# Pré-carregamento em segundo plano do formulário de veículos
+FIPE_PREFETCH_WORKERS = int(os.environ.get('CARRO_FIPE_PREFETCH_WORKERS', 4))
+FIPE_PREFETCH_MODELS = int(os.environ.get('CARRO_FIPE_PREFETCH_MODELS', 3))  # modelos com anos pré-carregados
+
+# Caches em memória separados por endpoint, para que listas de preços não
+# expulsem as marcas e modelos usados por todos; erros ficam em cache por 1 minuto.
+# As listas ficam como Catalog (tuplas), cerca de 4x menores que um DataFrame
+NEGATIVE_CACHE_TTL = int(os.environ.get('CARRO_FIPE_NEGATIVE_TTL', 60))
+brands_cache = EndpointCache('brands', maxsize=1, ttl=86400, negative_ttl=NEGATIVE_CACHE_TTL)
+models_cache = EndpointCache('models', maxsize=200, ttl=86400, negative_ttl=NEGATIVE_CACHE_TTL)
+years_cache = EndpointCache('years', maxsize=8000, ttl=86400, negative_ttl=NEGATIVE_CACHE_TTL)
+prices_cache = EndpointCache('prices', maxsize=5000, ttl=6 * 3600, negative_ttl=NEGATIVE_CACHE_TTL)
+ENDPOINT_CACHES = (brands_cache, models_cache, years_cache, prices_cache)
+
+# Índices de busca das listas em cache (marcas, modelos, anos), refeitos só
+# quando o cache entrega uma lista nova
+catalog_indexes = IndexCache(maxsize=2500)
+
+# Cache em disco que sobrevive a reinícios; entradas mais velhas que o TTL
+# continuam sendo servidas enquanto uma atualização roda em segundo plano
+persistent_cache = PersistentCache(FIPE_CACHE_PATH)
+PERSISTENT_CACHE_TTL = int(os.environ.get('CARRO_FIPE_CACHE_TTL', 86400))  # segundos
+
+_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='fipe-refresh')
+_refreshing = set()
+_refreshing_lock = threading.Lock()
 
-# Cache para 24 horas para reduzir chamadas à API
-cache = TTLCache(maxsize=100, ttl=86400)  # 24 horas
+# Requisições em andamento por caminho: chamadas simultâneas ao mesmo recurso
+# (formulário e pré-carregamento) aguardam uma única resposta
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+_prefetch_executor = ThreadPoolExecutor(max_workers=FIPE_PREFETCH_WORKERS, thread_name_prefix='fipe-prefetch')
+_prefetched = TTLCache(maxsize=1000, ttl=600)
+_prefetched_lock = threading.Lock()
 
 # Dados de fallback para quando a API falhar
-FALLBACK_BRANDS = pd.DataFrame([
+FALLBACK_BRANDS = Catalog.from_records([
     {'codigo': '21', 'nome': 'FIAT'},
     {'codigo': '59', 'nome': 'VOLKSWAGEN'},
     {'codigo': '23', 'nome': 'CHEVROLET'},
@@ -29,75 +79,336 @@ FALLBACK_BRANDS = pd.DataFrame([
     {'codigo': '48', 'nome': 'TOYOTA'}
 ])
 
-def create_session():
+def create_session(pool_size=FIPE_POOL_SIZE):
+    # requests e urllib3 (~90 ms de import) só carregam quando a primeira
+    # consulta à FIPE cria a sessão
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    class _CountingRetry(Retry):
+        # O urllib3 cria uma nova instância a cada tentativa, sempre pelo increment()
+        def increment(self, *args, **kwargs):
+            metrics.increment('fipe_retries')
+            return super().increment(*args, **kwargs)
+
     session = requests.Session()
-    retry = Retry(
+    retry = _CountingRetry(
         total=5,  # Aumentado número de tentativas
         backoff_factor=1,  # Aumentado tempo entre tentativas
         status_forcelist=[429, 500, 502, 503, 504],
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size)
     session.mount('http://', adapter)
     session.mount('https://', adapter)
     return session
 
-@cached(cache)
+
+class RateLimiter:
+    """
+    Token bucket: permite rajadas de até `burst` requisições e depois
+    `rate` por segundo. Só espera quando não há token disponível.
+    """
+
+    def __init__(self, rate=FIPE_RATE_LIMIT, burst=FIPE_RATE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            metrics.increment('fipe_rate_limited')
+            time.sleep(wait)
+
+
+def create_transport(mode=FIPE_TRANSPORT, base_url=BASE_URL, timeout=FIPE_TIMEOUT,
+                     fixture_path=FIPE_FIXTURE, pool_size=FIPE_POOL_SIZE):
+    if mode == 'replay':
+        return ReplayTransport(fixture_path, latency=FIPE_REPLAY_LATENCY, error_rate=FIPE_REPLAY_ERROR_RATE)
+
+    live = LiveTransport(create_session(pool_size), base_url, timeout)
+    if mode == 'record':
+        return RecordingTransport(live, fixture_path)
+    if mode != 'live':
+        raise ValueError(f"Transporte FIPE desconhecido: {mode}")
+    return live
+
+
+class FipeClient:
+    """
+    Cliente da FIPE compartilhado pelo processo: um único transporte (sessão
+    HTTP com conexões keep-alive, gravação ou reprodução de fixture) e um
+    limitador de taxa comum a todas as sessões do Streamlit.
+    """
+
+    def __init__(self, transport=None, rate_limiter=None):
+        self.transport = transport or create_transport()
+        self.rate_limiter = rate_limiter or RateLimiter()
+
+    @metrics.timed('fipe_http', 'get_json')
+    def get_json(self, path):
+        self.rate_limiter.acquire()
+        try:
+            return self.transport.get_json(path)
+        except Exception:
+            metrics.increment('fipe_http_errors')
+            raise
+
+    def close(self):
+        self.transport.close()
+
+
+# Criado na primeira consulta (ou substituído antes dela, como no benchmark)
+client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                client = FipeClient()
+    return client
+
+# Limite extra de um trabalho em lote (reavaliação), por thread; ver job_rate_limit()
+_job_limits = threading.local()
+
+@contextmanager
+def job_rate_limit(rate_limiter):
+    """
+    Faz cada requisição à API feita por esta thread dentro do bloco, inclusive
+    as dos catálogos, também consumir um token de `rate_limiter`.
+    """
+    previous = getattr(_job_limits, 'rate_limiter', None)
+    _job_limits.rate_limiter = rate_limiter
+    try:
+        yield
+    finally:
+        _job_limits.rate_limiter = previous
+
+def _fetch_json(path):
+    with _inflight_lock:
+        future = _inflight.get(path)
+        owner = future is None
+        if owner:
+            future = _inflight[path] = Future()
+    if not owner:
+        return future.result()
+
+    try:
+        job_limiter = getattr(_job_limits, 'rate_limiter', None)
+        if job_limiter is not None:
+            job_limiter.acquire()
+        payload = get_client().get_json(path)
+        persistent_cache.set(path, payload)
+        future.set_result(payload)
+        return payload
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(path, None)
+
+def _refresh(path):
+    try:
+        _fetch_json(path)
+        logger.info(f"Cache FIPE atualizado em segundo plano: {path}")
+    except Exception as e:
+        logger.warning(f"Falha ao atualizar cache FIPE ({path}): {e}")
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(path)
+
+def _schedule_refresh(path):
+    with _refreshing_lock:
+        if path in _refreshing:
+            return
+        _refreshing.add(path)
+    _refresh_executor.submit(_refresh, path)
+
+def _get_json(path):
+    """
+    Busca um recurso da API passando pelo cache persistente
+    (stale-while-revalidate): entradas vencidas são retornadas na hora
+    e atualizadas em segundo plano.
+    """
+    entry = persistent_cache.get(path)
+    if entry is not None:
+        payload, fetched_at = entry
+        if time.time() - fetched_at > PERSISTENT_CACHE_TTL:
+            metrics.increment('fipe_persistent_cache', 'stale')
+            _schedule_refresh(path)
+        else:
+            metrics.increment('fipe_persistent_cache', 'hit')
+        return payload
+    metrics.increment('fipe_persistent_cache', 'miss')
+    return _fetch_json(path)
+
+@brands_cache
+def _load_brands():
+    return Catalog.from_records(_get_json("marcas"))
+
+@models_cache
+def _load_models(brand_code):
+    return Catalog.from_records(_get_json(f"marcas/{brand_code}/modelos")['modelos'])
+
+@metrics.timed('fipe_call')
 def get_fipe_brands():
     try:
         logger.info("Tentando obter marcas da tabela FIPE...")
-        session = create_session()
-        response = session.get(f"{BASE_URL}/marcas", timeout=5)  # Timeout de 5 segundos
-        
-        if response.status_code == 200:
-            data = response.json()
-            logger.info(f"Obtidas {len(data)} marcas com sucesso")
-            return pd.DataFrame(data)
-            
-        logger.warning(f"API retornou status {response.status_code}. Usando dados fallback...")
-        return FALLBACK_BRANDS
-            
+        data = _load_brands()
+        logger.info(f"Obtidas {len(data)} marcas com sucesso")
+        return data
+
     except Exception as e:
-        logger.error(f"Erro ao obter marcas da tabela FIPE: {e}")
+        # HTTPError do requests traz a resposta; sem ela, a falha foi antes (rede, cache)
+        response = getattr(e, 'response', None)
+        if response is not None:
+            logger.warning(f"API retornou status {response.status_code}. Usando dados fallback...")
+        else:
+            logger.error(f"Erro ao obter marcas da tabela FIPE: {e}")
         return FALLBACK_BRANDS
 
-@cached(cache)
+@metrics.timed('fipe_call')
 def get_fipe_models(brand_code):
     try:
-        session = create_session()
-        response = session.get(f"{BASE_URL}/marcas/{brand_code}/modelos", timeout=5)
-        sleep(0.5)  # Reduzido tempo de espera
-        
-        if response.status_code == 200:
-            return pd.DataFrame(response.json()['modelos'])
-        return pd.DataFrame([{'codigo': '0', 'nome': 'Erro ao carregar modelos'}])
+        return _load_models(brand_code)
     except Exception as e:
         logging.error(f"Erro ao obter modelos da tabela FIPE: {e}")
-        return pd.DataFrame([{'codigo': '0', 'nome': 'Erro ao carregar modelos'}])
+        return Catalog(['0'], ['Erro ao carregar modelos'])
 
-@cached(cache)
+@metrics.timed('fipe_call', 'get_fipe_years')
+@years_cache
 def get_fipe_years(brand_code, model_code):
     try:
-        session = create_session()
-        response = session.get(f"{BASE_URL}/marcas/{brand_code}/modelos/{model_code}/anos")
-        sleep(1)
-        
-        if response.status_code == 200:
-            return pd.DataFrame(response.json())
-        response.raise_for_status()
+        return Catalog.from_records(_get_json(f"marcas/{brand_code}/modelos/{model_code}/anos"))
     except Exception as e:
         logging.error(f"Erro ao obter anos da tabela FIPE: {e}")
         raise Exception("Erro ao obter anos da tabela FIPE")
 
-@cached(cache)
+@metrics.timed('fipe_call', 'get_fipe_price')
+@prices_cache
 def get_fipe_price(brand_code, model_code, year_code):
     try:
-        session = create_session()
-        response = session.get(f"{BASE_URL}/marcas/{brand_code}/modelos/{model_code}/anos/{year_code}")
-        sleep(1)
-        
-        if response.status_code == 200:
-            return response.json()
-        response.raise_for_status()
+        return _get_json(f"marcas/{brand_code}/modelos/{model_code}/anos/{year_code}")
     except Exception as e:
         logging.error(f"Erro ao obter preço da tabela FIPE: {e}")
         raise Exception("Erro ao obter preço da tabela FIPE")
+
+def get_fipe_brand_index():
+    """
+    CatalogIndex das marcas: consultas nome <-> código e busca enquanto se digita.
+    """
+    return catalog_indexes.get('marcas', get_fipe_brands())
+
+def get_fipe_model_index(brand_code):
+    return catalog_indexes.get(f'marcas/{brand_code}/modelos', get_fipe_models(brand_code))
+
+def get_fipe_year_index(brand_code, model_code):
+    return catalog_indexes.get(
+        f'marcas/{brand_code}/modelos/{model_code}/anos', get_fipe_years(brand_code, model_code)
+    )
+
+def get_cache_stats():
+    """
+    Contadores dos caches em memória por endpoint (acertos, faltas,
+    erros em cache, remoções e latência das cargas).
+    """
+    return {endpoint_cache.name: endpoint_cache.stats() for endpoint_cache in ENDPOINT_CACHES}
+
+@metrics.register_collector
+def _cache_metrics():
+    samples = []
+    for endpoint, stats in get_cache_stats().items():
+        for stat in ('size', 'hits', 'negative_hits', 'misses', 'evictions', 'errors'):
+            samples.append((f'fipe_cache_{stat}', {'endpoint': endpoint}, stats[stat]))
+    return samples
+
+def parse_fipe_price(fipe_data):
+    """
+    Converte o campo 'Valor' da API ("R$ 12.345,67") em float.
+    """
+    return float(fipe_data['Valor'].replace('R$ ', '').replace('.', '').replace(',', '.'))
+
+MONTHS = {
+    'janeiro': 1, 'fevereiro': 2, 'março': 3, 'abril': 4, 'maio': 5, 'junho': 6,
+    'julho': 7, 'agosto': 8, 'setembro': 9, 'outubro': 10, 'novembro': 11, 'dezembro': 12,
+}
+
+def parse_fipe_month(fipe_data):
+    """
+    Converte 'MesReferencia' ("outubro de 2024") em AAAAMM. Sem o campo,
+    usa o mês atual.
+    """
+    try:
+        month_name, year = fipe_data['MesReferencia'].strip().lower().split(' de ')
+        return int(year) * 100 + MONTHS[month_name]
+    except (KeyError, ValueError, AttributeError):
+        today = time.localtime()
+        return today.tm_year * 100 + today.tm_mon
+
+def fetch_current_fipe_price(brand_code, model_code, year_code):
+    """
+    Busca o preço direto na API, ignorando os caches (o resultado atualiza o
+    cache persistente e o de memória). Usado na reavaliação da frota.
+    """
+    price = _fetch_json(f"marcas/{brand_code}/modelos/{model_code}/anos/{year_code}")
+    # Mesma chave do decorador em get_fipe_price: os argumentos posicionais
+    prices_cache.set((brand_code, model_code, year_code), price)
+    return price
+
+# Pré-carregamento especulativo para o formulário de veículos
+def _submit_prefetch(key, fn, *args):
+    # Evita reenfileirar o mesmo trabalho a cada rerun do Streamlit
+    with _prefetched_lock:
+        if key in _prefetched:
+            return
+        _prefetched[key] = True
+    _prefetch_executor.submit(_run_prefetch, key, fn, *args)
+
+def _run_prefetch(key, fn, *args):
+    try:
+        fn(*args)
+    except Exception as e:
+        logger.warning(f"Falha no pré-carregamento FIPE {key}: {e}")
+        with _prefetched_lock:
+            _prefetched.pop(key, None)
+
+def _prefetch_brand(brand_code, likely_models):
+    models = get_fipe_model_index(brand_code)
+
+    # O primeiro modelo é o selecionado por padrão no formulário
+    candidates = list(models.names[:1])
+    candidates += [name for name in likely_models if name in models and name not in candidates]
+    for name in candidates[:FIPE_PREFETCH_MODELS]:
+        model_code = models.code(name)
+        _submit_prefetch(('years', brand_code, model_code), get_fipe_years, brand_code, model_code)
+
+def _prefetch_model(brand_code, model_code):
+    years = get_fipe_years(brand_code, model_code)
+    for year_code in years.codes:
+        _submit_prefetch(('price', brand_code, model_code, year_code), get_fipe_price, brand_code, model_code, year_code)
+
+def prefetch_brand(brand_code, likely_models=()):
+    """
+    Em segundo plano, carrega os modelos da marca e os anos dos modelos mais
+    prováveis (o primeiro da lista e os `likely_models` já cadastrados).
+    """
+    _submit_prefetch(('brand', brand_code), _prefetch_brand, brand_code, tuple(likely_models))
+
+def prefetch_model(brand_code, model_code):
+    """
+    Em segundo plano, carrega os anos do modelo e o preço de cada ano.
+    """
+    _submit_prefetch(('model', brand_code, model_code), _prefetch_model, brand_code, model_code)
@@ -0,0 +1,177 @@
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from cachetools import TTLCache
+
+# Arquivo do cache persistente da FIPE, por padrão ao lado do vehicles.db
+FIPE_CACHE_PATH = os.environ.get(
+    'CARRO_FIPE_CACHE_PATH',
+    os.path.join(os.path.dirname(os.environ.get('CARRO_DB_PATH', 'vehicles.db')), 'fipe_cache.db')
+)
+
+
+class PersistentCache:
+    """
+    Key/value store in SQLite that survives restarts. Each entry keeps the
+    JSON payload returned by the API and the time it was fetched.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS fipe_cache (
+                    key TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    fetched_at REAL NOT NULL
+                )
+            ''')
+            self._conn = conn
+        return self._conn
+
+    def get(self, key):
+        """
+        Return (payload, fetched_at) or None when the key was never stored
+        """
+        with self._lock:
+            row = self._connection().execute(
+                'SELECT payload, fetched_at FROM fipe_cache WHERE key = ?', (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, payload, fetched_at=None):
+        with self._lock:
+            self._connection().execute(
+                'INSERT OR REPLACE INTO fipe_cache (key, payload, fetched_at) VALUES (?, ?, ?)',
+                (key, json.dumps(payload), fetched_at if fetched_at is not None else time.time())
+            )
+
+    def clear(self):
+        with self._lock:
+            self._connection().execute('DELETE FROM fipe_cache')
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class _EvictionCountingTTLCache(TTLCache):
+    # O TTLCache chama popitem() quando precisa abrir espaço
+    def __init__(self, maxsize, ttl, on_evict):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self._on_evict = on_evict
+
+    def popitem(self):
+        item = super().popitem()
+        self._on_evict()
+        return item
+
+
+class EndpointCache:
+    """
+    In-memory cache for one FIPE endpoint, with its own size and TTL.
+    Errors are cached for `negative_ttl` seconds so a broken code does not
+    hit the API on every call; only their type and arguments are kept, and
+    each hit raises a fresh exception. All access is lock-protected and counted.
+    """
+
+    def __init__(self, name, maxsize, ttl, negative_ttl=60):
+        self.name = name
+        self._lock = threading.Lock()
+        self._values = _EvictionCountingTTLCache(maxsize, ttl, self._count_eviction)
+        self._errors = TTLCache(maxsize=maxsize, ttl=negative_ttl)
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+        self.load_time = 0.0
+        self.max_load_time = 0.0
+
+    def _count_eviction(self):
+        self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            try:
+                value = self._values[key]
+                self.hits += 1
+                return value
+            except KeyError:
+                pass
+            error = self._errors.get(key)
+            if error is not None:
+                self.negative_hits += 1
+                # Uma exceção nova por acerto: reerguer a mesma acumularia tracebacks
+                error_type, args = error
+                raise error_type(*args)
+            self.misses += 1
+
+        start = time.perf_counter()
+        try:
+            value = loader()
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+                self._errors[key] = (type(e), e.args)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.load_time += elapsed
+                self.max_load_time = max(self.max_load_time, elapsed)
+
+        with self._lock:
+            self._values[key] = value
+        return value
+
+    def __call__(self, fn):
+        # Uso como decorador: os argumentos posicionais formam a chave
+        @functools.wraps(fn)
+        def wrapper(*args):
+            return self.get_or_load(args, lambda: fn(*args))
+        wrapper.cache = self
+        return wrapper
+
+    def set(self, key, value):
+        """
+        Store a freshly fetched value, replacing any cached value or error
+        """
+        with self._lock:
+            self._values[key] = value
+            self._errors.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._errors.clear()
+
+    def stats(self):
+        with self._lock:
+            loads = self.misses
+            return {
+                'size': len(self._values),
+                'maxsize': self._values.maxsize,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'errors': self.errors,
+                'avg_load_ms': self.load_time / loads * 1000 if loads else 0.0,
+                'max_load_ms': self.max_load_time * 1000,
+            }
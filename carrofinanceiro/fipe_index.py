@@ -0,0 +1,169 @@
+import bisect
+import difflib
+import threading
+import unicodedata
+
+from cachetools import LRUCache
+
+# Limite padrão de resultados de uma busca (lista do formulário)
+SEARCH_LIMIT = 50
+FUZZY_CUTOFF = 0.6
+
+
+def normalize(text):
+    """
+    Lowercase, accent-free, single-spaced form used for searching
+    """
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode()
+    return ' '.join(text.casefold().split())
+
+
+class Catalog:
+    """
+    One FIPE list (brands, models or years of a model) as two parallel
+    tuples, `codes` and `names`; iterating yields (code, name) pairs.
+    Much smaller than a DataFrame, so the caches can hold many more lists
+    """
+    __slots__ = ('codes', 'names')
+
+    def __init__(self, codes=(), names=()):
+        self.codes = tuple(codes)
+        self.names = tuple(names)
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Build from API records: [{'codigo': ..., 'nome': ...}, ...]
+        """
+        return cls((record['codigo'] for record in records), (record['nome'] for record in records))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        return zip(self.codes, self.names)
+
+    def __repr__(self):
+        return f'Catalog({len(self)} itens)'
+
+    @property
+    def empty(self):
+        return not self.codes
+
+    def to_records(self):
+        return [{'codigo': code, 'nome': name} for code, name in self]
+
+    def to_frame(self):
+        """
+        DataFrame with the 'codigo' and 'nome' columns, for analysis
+        """
+        import pandas as pd  # só quem pede um DataFrame paga o import
+
+        return pd.DataFrame({'codigo': list(self.codes), 'nome': list(self.names)})
+
+
+class CatalogIndex:
+    """
+    Lookup structures over one FIPE list (brands, models or years of a
+    model), built once per dataset: name -> code, code -> name, name ->
+    position and a sorted word-prefix index for type-ahead search
+    """
+
+    def __init__(self, catalog):
+        self.names = catalog.names
+        self.codes = catalog.codes
+        self.code_by_name = dict(zip(self.names, self.codes))
+        self.name_by_code = dict(zip(self.codes, self.names))
+        self.position = {name: index for index, name in reversed(list(enumerate(self.names)))}
+
+        self._normalized = [normalize(name) for name in self.names]
+        # Cada início de palavra vira uma chave: "gol 1.0 flex" -> "gol 1.0 flex", "1.0 flex", "flex"
+        self._prefixes = sorted(
+            (words[start:], index)
+            for index, words in enumerate(self._normalized)
+            for start in [0] + [i + 1 for i, char in enumerate(words) if char == ' ']
+        )
+        self._prefix_keys = [key for key, _ in self._prefixes]
+        self._words = {}
+        for index, words in enumerate(self._normalized):
+            for word in words.split():
+                self._words.setdefault(word, set()).add(index)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.code_by_name
+
+    def code(self, name):
+        return self.code_by_name.get(name)
+
+    def name(self, code):
+        return self.name_by_code.get(code)
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """
+        Names matching `query`, best first: whole-name prefix, word prefix,
+        substring and, when nothing else matches, names matching every typed
+        word by prefix or close spelling
+        """
+        query = normalize(query)
+        if not query:
+            return list(self.names[:limit])
+
+        start = bisect.bisect_left(self._prefix_keys, query)
+        whole, word = [], []
+        for key, index in self._prefixes[start:]:
+            if not key.startswith(query):
+                break
+            (whole if key == self._normalized[index] else word).append(index)
+
+        found = sorted(set(whole)) + sorted(set(word) - set(whole))
+        if len(found) < limit:
+            seen = set(found)
+            found += [
+                index for index, name in enumerate(self._normalized)
+                if index not in seen and query in name
+            ]
+        if not found:
+            found = self._fuzzy(query)
+
+        return [self.names[index] for index in found[:limit]]
+
+    def _fuzzy(self, query):
+        # Cada palavra digitada precisa casar com alguma palavra do nome,
+        # por prefixo ou por grafia parecida ("flx" -> "flex")
+        matches = None
+        for term in query.split():
+            words = [word for word in self._words if word.startswith(term)]
+            words += difflib.get_close_matches(term, self._words, n=10, cutoff=FUZZY_CUTOFF)
+            indexes = set().union(*(self._words[word] for word in words))
+            matches = indexes if matches is None else matches & indexes
+            if not matches:
+                return []
+        return sorted(matches)
+
+
+class IndexCache:
+    """
+    Keeps the CatalogIndex of each cached dataset; the index is rebuilt
+    only when the cache hands out a new object for the same key
+    """
+
+    def __init__(self, maxsize):
+        self._entries = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def get(self, key, catalog):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] is catalog:
+            return entry[1]
+        index = CatalogIndex(catalog)
+        with self._lock:
+            self._entries[key] = (catalog, index)
+        return index
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,176 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fipe_transport import _http_error
+
+# Tamanho do catálogo sintético, próximo ao da tabela FIPE de carros
+STANDIN_BRANDS = 90
+STANDIN_MAX_MODELS = 600
+STANDIN_MAX_YEARS = 12
+
+FUELS = (('Gasolina', 1, 'G'), ('Álcool', 2, 'A'), ('Diesel', 3, 'D'))
+
+ROUTES = (
+    (re.compile(r'^/marcas$'), 'brands'),
+    (re.compile(r'^/marcas/(\d+)/modelos$'), 'models'),
+    (re.compile(r'^/marcas/(\d+)/modelos/(\d+)/anos$'), 'years'),
+    (re.compile(r'^/marcas/(\d+)/modelos/(\d+)/anos/(\d+)-(\d)$'), 'price'),
+)
+
+
+def _rng(*parts):
+    # Mesmo catálogo em toda execução: a semente depende só do caminho
+    return random.Random(zlib.crc32('/'.join(map(str, parts)).encode()))
+
+
+@lru_cache(maxsize=None)
+def brands():
+    return [{'codigo': str(code), 'nome': f'MARCA {code:03d}'} for code in range(1, STANDIN_BRANDS + 1)]
+
+
+@lru_cache(maxsize=4096)
+def models(brand_code):
+    count = _rng('models', brand_code).randint(20, STANDIN_MAX_MODELS)
+    return [
+        {'codigo': brand_code * 10000 + index, 'nome': f'MODELO {brand_code:03d}-{index:04d} 1.0 Flex'}
+        for index in range(1, count + 1)
+    ]
+
+
+@lru_cache(maxsize=65536)
+def years(brand_code, model_code):
+    rng = _rng('years', brand_code, model_code)
+    first = rng.randint(1995, 2020)
+    fuel_name, fuel_code, _ = rng.choice(FUELS)
+    count = rng.randint(1, STANDIN_MAX_YEARS)
+    return [
+        {'codigo': f'{year}-{fuel_code}', 'nome': f'{year} {fuel_name}'}
+        for year in range(min(first + count - 1, 2026), first - 1, -1)
+    ]
+
+
+def price(brand_code, model_code, year, fuel_code):
+    rng = _rng('price', brand_code, model_code, year, fuel_code)
+    value = rng.randint(8000, 250000) * (1 + (year - 1995) / 40)
+    fuel_name, _, fuel_symbol = next(fuel for fuel in FUELS if fuel[1] == fuel_code)
+    reais = f"{value:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.')
+    return {
+        'TipoVeiculo': 1,
+        'Valor': f'R$ {reais}',
+        'Marca': f'MARCA {brand_code:03d}',
+        'Modelo': f'MODELO {brand_code:03d}-{model_code % 10000:04d} 1.0 Flex',
+        'AnoModelo': year,
+        'Combustivel': fuel_name,
+        'CodigoFipe': f'{brand_code:03d}{model_code % 10000:03d}-{fuel_code}',
+        'MesReferencia': 'outubro de 2026 ',
+        'SiglaCombustivel': fuel_symbol,
+    }
+
+
+def resolve(path):
+    """
+    Return the synthetic payload for an API path, or None for unknown paths
+    """
+    for pattern, route in ROUTES:
+        match = pattern.match(path)
+        if not match:
+            continue
+        args = [int(group) for group in match.groups()]
+        if route == 'brands':
+            return brands()
+        if not 1 <= args[0] <= STANDIN_BRANDS:
+            return None
+        if route == 'models':
+            return {'modelos': models(args[0]), 'anos': []}
+        if args[1] not in {model['codigo'] for model in models(args[0])}:
+            return None
+        if route == 'years':
+            return years(args[0], args[1])
+        if f'{args[2]}-{args[3]}' not in {year['codigo'] for year in years(args[0], args[1])}:
+            return None
+        return price(*args)
+    return None
+
+
+class StandinTransport:
+    """
+    Serves the synthetic catalog in-process, without sockets; a drop-in
+    transport for FipeClient in benchmarks
+    """
+
+    def get_json(self, path):
+        payload = resolve('/' + path)
+        if payload is None:
+            raise _http_error(path, 404)
+        return payload
+
+    def close(self):
+        pass
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, como a API real
+    latency = 0.0
+    error_rate = 0.0
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            self._send(503, {'error': 'erro injetado'})
+            return
+        payload = resolve(self.path.rstrip('/'))
+        if payload is None:
+            self._send(404, {'error': 'não encontrado'})
+        else:
+            self._send(200, payload)
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=0, latency=0.0, error_rate=0.0):
+    """
+    Start the stand-in server in a background thread. Returns the server;
+    its base URL is f"http://127.0.0.1:{server.server_port}"
+    """
+    handler = type('Handler', (StandinHandler,), {'latency': latency, 'error_rate': error_rate})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local com um catálogo FIPE sintético")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="atraso por requisição, em segundos")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fração de respostas 503 (0 a 1)")
+    args = parser.parse_args()
+
+    server = start_server(args.port, args.latency, args.error_rate)
+    print(f"Catálogo FIPE sintético em http://127.0.0.1:{server.server_port}")
+    print(f"Use CARRO_FIPE_BASE_URL=http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import json
+import os
+import random
+import threading
+import time
+
+
+class LiveTransport:
+    """
+    Talks to the FIPE API (or a stand-in server) over HTTP
+    """
+
+    def __init__(self, session, base_url, timeout):
+        self.session = session
+        self.base_url = base_url
+        self.timeout = timeout
+
+    def get_json(self, path):
+        response = self.session.get(f"{self.base_url}/{path}", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def close(self):
+        self.session.close()
+
+
+class RecordingTransport:
+    """
+    Forwards to another transport and saves every successful response to a
+    JSON fixture file, to be replayed later by ReplayTransport
+    """
+
+    def __init__(self, inner, fixture_path):
+        self.inner = inner
+        self.fixture_path = fixture_path
+        self._lock = threading.Lock()
+        self._responses = _load_fixture(fixture_path) if os.path.exists(fixture_path) else {}
+
+    def get_json(self, path):
+        payload = self.inner.get_json(path)
+        with self._lock:
+            self._responses[path] = payload
+            self._save()
+        return payload
+
+    def _save(self):
+        # Grava em arquivo temporário e renomeia para não corromper a fixture
+        tmp_path = f"{self.fixture_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'responses': self._responses}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.fixture_path)
+
+    def close(self):
+        self.inner.close()
+
+
+class ReplayTransport:
+    """
+    Serves responses from a fixture file without network access. `latency`
+    (seconds) and `error_rate` (0 to 1) inject delay and HTTP 503 errors;
+    paths missing from the fixture answer 404
+    """
+
+    def __init__(self, fixture_path, latency=0.0, error_rate=0.0, seed=None):
+        self.fixture_path = fixture_path
+        self.latency = latency
+        self.error_rate = error_rate
+        self._responses = _load_fixture(fixture_path)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def get_json(self, path):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            failed = self.error_rate and self._random.random() < self.error_rate
+        if failed:
+            raise _http_error(path, 503)
+        if path not in self._responses:
+            raise _http_error(path, 404)
+        return self._responses[path]
+
+    def close(self):
+        pass
+
+
+def _load_fixture(fixture_path):
+    with open(fixture_path, encoding='utf-8') as f:
+        return json.load(f)['responses']
+
+
+def _http_error(path, status_code):
+    import requests  # o requests só é carregado quando a FIPE é usada
+
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = path
+    return requests.HTTPError(f"{status_code} para {path}", response=response)
@@ -0,0 +1,117 @@
+import argparse
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from database import init_db, get_image_variant
+
+# Servidor de fotos opcional: com a porta definida, as fotos saem daqui com
+# cache imutável e 304, em vez do static serving do Streamlit
+IMAGE_SERVER_PORT = int(os.environ.get('CARRO_IMAGE_SERVER_PORT', 0))
+# URL pública do servidor, vista pelo navegador. Vazia: o host da requisição do
+# Streamlit com a porta acima (defina-a atrás de proxy ou com HTTPS)
+IMAGE_SERVER_URL = os.environ.get('CARRO_IMAGE_SERVER_URL', '').rstrip('/')
+
+# O conteúdo de uma URL nunca muda (o hash faz parte dela)
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Original servido no lugar de uma derivada que ainda não existe: cache curto,
+# para o navegador buscar a derivada quando o backfill_derivatives criá-la
+FALLBACK_CACHE_CONTROL = 'public, max-age=60'
+
+PATH_PATTERN = re.compile(r'^/img/([0-9a-f]{64})/(thumb|display|original)$')
+
+_server = None
+_server_lock = threading.Lock()
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def _serve(self, send_body):
+        match = PATH_PATTERN.match(self.path.split('?', 1)[0])
+        if not match:
+            self._send_empty(404)
+            return
+
+        image_hash, variant = match.groups()
+        etag = f'"{image_hash}-{variant}"'
+        if etag in self.headers.get('If-None-Match', ''):
+            self._send_empty(304, etag)
+            return
+
+        image = get_image_variant(image_hash, variant)
+        cache_control = CACHE_CONTROL
+        if image is None and variant != 'original':
+            # Foto antiga sem derivadas: serve o original, com validador próprio
+            image = get_image_variant(image_hash, 'original')
+            etag = f'"{image_hash}-{variant}-original"'
+            cache_control = FALLBACK_CACHE_CONTROL
+            if image is not None and etag in self.headers.get('If-None-Match', ''):
+                self._send_empty(304, etag, cache_control)
+                return
+        if image is None:
+            self._send_empty(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', image['mime_type'])
+        self.send_header('Content-Length', str(len(image['data'])))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', cache_control)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(image['data'])
+
+    def _send_empty(self, status, etag=None, cache_control=CACHE_CONTROL):
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache_control)
+        else:
+            self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=IMAGE_SERVER_PORT, host='0.0.0.0'):
+    """
+    Start the image server once per process, in a background thread
+    """
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), ImageHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True, name='image-server').start()
+        return _server
+
+
+def image_server_url(image_hash, variant, base_url=IMAGE_SERVER_URL):
+    return f"{base_url}/img/{image_hash}/{variant}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor das fotos dos veículos")
+    parser.add_argument('--port', type=int, default=IMAGE_SERVER_PORT or 8502)
+    args = parser.parse_args()
+
+    init_db()
+    server = start_server(args.port)
+    print(f"Fotos em http://0.0.0.0:{server.server_port}/img/<hash>/<thumb|display|original>")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import unicodedata
+from collections import namedtuple
+from datetime import datetime
+
+from database import init_db, get_vehicles, add_vehicles, add_maintenance_records
+from reports import MAINTENANCE_REPORT_COLUMNS
+from revaluation import REVALUATION_WORKERS, fetch_fipe_prices, resolve_fipe_codes
+
+# Linhas por executemany; todos os lotes de um arquivo vão na mesma transação
+IMPORT_BATCH_SIZE = int(os.environ.get('CARRO_IMPORT_BATCH_SIZE', 5000))
+
+FORMATS = {'.csv': 'csv', '.json': 'json', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+# Campo -> rótulo; o relatório de manutenções exportado volta pelo importador
+FIELD_LABELS = {
+    **MAINTENANCE_REPORT_COLUMNS,
+    'vehicle_id': 'Veículo',
+    'author': 'Autor',
+    'color': 'Cor',
+    'purchase_price': 'Valor de Aquisição',
+    'additional_costs': 'Custos Adicionais',
+    'fipe_price': 'Valor FIPE',
+}
+
+# Nomes aceitos no cabeçalho além do campo e do rótulo (comparados sem acento e caixa)
+FIELD_ALIASES = {
+    'vehicle_id': ('id_veiculo', 'veiculo_id'),
+    'purchase_price': ('preco_de_compra', 'valor_de_compra'),
+    'fipe_price': ('preco_fipe',),
+    'mileage': ('km',),
+}
+
+VEHICLE_NAME_FIELDS = ('brand', 'model', 'year')
+
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y')
+
+# Ponto como separador de milhar: "12.345", "1.234.567" (mas não "12.5" nem "1.0")
+THOUSANDS_PATTERN = re.compile(r'^\d{1,3}(\.\d{3})+$')
+
+# Linhas inválidas listadas na saída da linha de comando
+CLI_MAX_FAILURES = 20
+
+ImportResult = namedtuple('ImportResult', ['imported', 'failures'])
+
+
+class ImportValidationError(ValueError):
+    """
+    Raised when a file has invalid rows and nothing was written;
+    `failures` holds (line, error message) pairs
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__(f"{len(failures)} linhas inválidas; nada foi importado")
+
+
+def _normalize(name):
+    name = unicodedata.normalize('NFKD', str(name)).encode('ascii', 'ignore').decode()
+    return '_'.join(name.lower().replace('(r$)', '').split())
+
+
+_COLUMNS = {
+    _normalize(alias): field
+    for field, label in FIELD_LABELS.items()
+    for alias in (field, label) + FIELD_ALIASES.get(field, ())
+}
+
+
+def _format(name):
+    extension = os.path.splitext(name.lower())[1]
+    if extension not in FORMATS:
+        raise ValueError(f"Formato não suportado: {name} (use CSV, JSON ou JSON Lines)")
+    return FORMATS[extension]
+
+
+def _read_rows(fileobj, name):
+    """
+    Stream (line, {field: raw value}) pairs from a binary CSV, JSON Lines or
+    JSON (list of objects) file; lines of JSON lists are record positions
+    """
+    file_format = _format(name)
+    text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    try:
+        if file_format == 'json':
+            records = json.load(text)
+            if not isinstance(records, list):
+                raise ValueError("O JSON deve ser uma lista de objetos")
+            rows = enumerate(records, start=1)
+        elif file_format == 'jsonl':
+            rows = ((line, json.loads(raw)) for line, raw in enumerate(text, start=1) if raw.strip())
+        else:
+            # Planilhas brasileiras costumam exportar com ';'
+            sample = text.read(64 * 1024)
+            text.seek(0)
+            try:
+                dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+            except csv.Error:
+                dialect = csv.excel
+            reader = csv.DictReader(text, dialect=dialect)
+            rows = ((reader.line_num, row) for row in reader)
+
+        for line, row in rows:
+            if not isinstance(row, dict):
+                raise ValueError(f"linha {line}: registro não é um objeto")
+            yield line, {
+                _COLUMNS[_normalize(column)]: value
+                for column, value in row.items()
+                if column is not None and _normalize(column) in _COLUMNS
+            }
+    finally:
+        # Solta o arquivo do chamador sem fechá-lo (fechar o wrapper fecharia o upload)
+        text.detach()
+
+
+def _missing(row, field):
+    value = row.get(field)
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _text(row, field):
+    if _missing(row, field):
+        raise ValueError(f"{FIELD_LABELS[field]} não informado")
+    return str(row[field]).strip()
+
+
+def _money(row, field):
+    if _missing(row, field):
+        raise ValueError(f"{FIELD_LABELS[field]} não informado")
+    value = row[field]
+    if isinstance(value, str):
+        value = value.replace('R$', '').strip()
+        # "12.345,67" -> 12345.67; "12.345" -> 12345; "12345.67" fica como está
+        if ',' in value:
+            value = value.replace('.', '').replace(',', '.')
+        elif THOUSANDS_PATTERN.match(value):
+            value = value.replace('.', '')
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{FIELD_LABELS[field]} inválido: {row[field]}") from None
+    if value < 0:
+        raise ValueError(f"{FIELD_LABELS[field]} negativo: {row[field]}")
+    return value
+
+
+def _integer(row, field, thousands=False):
+    """
+    Whole number: "12", 12 or "12.0"; with `thousands`, "12.345" is 12345,
+    without it such values are rejected as ambiguous
+    """
+    value = row[field]
+    if isinstance(value, str):
+        value = value.strip()
+        if THOUSANDS_PATTERN.match(value):
+            if not thousands:
+                # "1.000" seria 1 para o float e 1000 para quem escreveu em pt-BR
+                raise ValueError(f"{FIELD_LABELS[field]} ambíguo: {row[field]} (informe sem separador de milhar)")
+            value = value.replace('.', '')
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        number = None
+    if isinstance(value, bool) or number is None or not number.is_integer():
+        raise ValueError(f"{FIELD_LABELS[field]} inválido: {row[field]}")
+    return int(number)
+
+
+def _date(row, field):
+    value = _text(row, field)
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).strftime('%Y-%m-%d')
+        except ValueError:
+            pass
+    raise ValueError(f"{FIELD_LABELS[field]} inválida: {value} (use AAAA-MM-DD ou DD/MM/AAAA)")
+
+
+def _name_key(brand, model, year):
+    return tuple(str(part).strip().casefold() for part in (brand, model, year))
+
+
+def _parse_vehicle(row):
+    vehicle = {field: _text(row, field) for field in VEHICLE_NAME_FIELDS}
+    vehicle['purchase_price'] = _money(row, 'purchase_price')
+    vehicle['additional_costs'] = 0.0 if _missing(row, 'additional_costs') else _money(row, 'additional_costs')
+    vehicle['fipe_price'] = None if _missing(row, 'fipe_price') else _money(row, 'fipe_price')
+    vehicle['color'] = '' if _missing(row, 'color') else str(row['color']).strip()
+    return vehicle
+
+
+def _parse_maintenance(row, vehicle_ids, vehicles_by_name, author):
+    if not _missing(row, 'vehicle_id'):
+        vehicle_id = _integer(row, 'vehicle_id')
+        if vehicle_id not in vehicle_ids:
+            raise ValueError(f"Veículo não encontrado: {vehicle_id}")
+    else:
+        names = [_text(row, field) for field in VEHICLE_NAME_FIELDS]
+        matches = vehicles_by_name.get(_name_key(*names), [])
+        if not matches:
+            raise ValueError(f"Veículo não encontrado: {' '.join(names)}")
+        if len(matches) > 1:
+            raise ValueError(f"Mais de um veículo {' '.join(names)}; informe o id do veículo")
+        vehicle_id = matches[0]
+
+    if _missing(row, 'author') and not author:
+        raise ValueError(f"{FIELD_LABELS['author']} não informado")
+
+    return {
+        'vehicle_id': vehicle_id,
+        'date': _date(row, 'date'),
+        'description': _text(row, 'description'),
+        'cost': _money(row, 'cost'),
+        'mileage': None if _missing(row, 'mileage') else _integer(row, 'mileage', thousands=True),
+        'author': author if _missing(row, 'author') else str(row['author']).strip(),
+    }
+
+
+def _size(fileobj):
+    try:
+        position = fileobj.tell()
+        size = fileobj.seek(0, io.SEEK_END)
+        fileobj.seek(position)
+        return size or None
+    except (AttributeError, OSError):
+        return None
+
+
+def _resolve_fipe(vehicles, failures, workers):
+    """
+    Check brand/model/year against the (cached) FIPE catalog and fill in the
+    current price of vehicles without one. Drops the vehicles that failed
+    """
+    keys = {(vehicle['brand'], vehicle['model'], vehicle['year']) for _, vehicle in vehicles}
+    missing_price = {
+        (vehicle['brand'], vehicle['model'], vehicle['year'])
+        for _, vehicle in vehicles if vehicle['fipe_price'] is None
+    }
+
+    # Um preço por combinação de nomes, como na reavaliação da frota
+    prices, errors = fetch_fipe_prices(missing_price, workers=workers) if missing_price else ({}, {})
+    for key in keys - missing_price:
+        try:
+            resolve_fipe_codes(*key)
+        except Exception as e:
+            errors[key] = str(e)
+
+    resolved = []
+    for line, vehicle in vehicles:
+        key = (vehicle['brand'], vehicle['model'], vehicle['year'])
+        if key in errors:
+            failures.append((line, errors[key]))
+            continue
+        if key in prices:
+            vehicle['fipe_price'], vehicle['fipe_month'] = prices[key]
+        resolved.append((line, vehicle))
+    return resolved
+
+
+def _batches(records, batch_size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_vehicles(fileobj, name, resolve_fipe=True, skip_invalid=False,
+                    batch_size=IMPORT_BATCH_SIZE, workers=REVALUATION_WORKERS, progress=None):
+    """
+    Import vehicles from a binary CSV/JSON file; `name` picks the format.
+    Names are checked against the FIPE catalog and vehicles without a FIPE
+    price get the current one (`resolve_fipe=False` skips both, and then the
+    price is required). Invalid rows raise ImportValidationError before
+    anything is written, unless `skip_invalid`; all rows go in one
+    transaction. `progress(done, fraction)` is called after each batch.
+    Returns ImportResult(imported, failures), failures being (line, error) pairs
+    """
+    vehicles = []
+    failures = []
+    for line, row in _read_rows(fileobj, name):
+        try:
+            vehicle = _parse_vehicle(row)
+            if vehicle['fipe_price'] is None and not resolve_fipe:
+                raise ValueError(f"{FIELD_LABELS['fipe_price']} não informado")
+            vehicles.append((line, vehicle))
+        except ValueError as e:
+            failures.append((line, str(e)))
+
+    # As consultas à FIPE ficam fora da transação de escrita
+    if resolve_fipe and vehicles:
+        vehicles = _resolve_fipe(vehicles, failures, workers)
+
+    failures.sort()
+    if failures and not skip_invalid:
+        raise ImportValidationError(failures)
+
+    imported = add_vehicles(
+        _batches((vehicle for _, vehicle in vehicles), batch_size),
+        progress=progress and (lambda done: progress(done, done / len(vehicles)))
+    )
+    return ImportResult(imported, failures)
+
+
+def import_maintenance(fileobj, name, author=None, skip_invalid=False,
+                       batch_size=IMPORT_BATCH_SIZE, progress=None):
+    """
+    Stream maintenance records from a binary CSV/JSON file (the exported
+    maintenance report included) into the database. Each row names its
+    vehicle by id or by brand/model/year; `author` fills rows without one.
+    Rows are validated and written in batches inside one transaction: an
+    invalid row (unless `skip_invalid`) or any error rolls everything back,
+    invalid rows raising ImportValidationError with all of them listed.
+    `progress(done, fraction)` is called after each batch, fraction being
+    the share of the file read (None when the size is unknown), and with
+    1.0 once the import finishes. Returns ImportResult(imported, failures)
+    """
+    vehicles = get_vehicles()
+    vehicle_ids = {vehicle['id'] for vehicle in vehicles}
+    vehicles_by_name = {}
+    for vehicle in vehicles:
+        key = _name_key(vehicle['brand'], vehicle['model'], vehicle['year'])
+        vehicles_by_name.setdefault(key, []).append(vehicle['id'])
+
+    size = _size(fileobj)
+    failures = []
+
+    def records():
+        for line, row in _read_rows(fileobj, name):
+            try:
+                record = _parse_maintenance(row, vehicle_ids, vehicles_by_name, author)
+            except ValueError as e:
+                failures.append((line, str(e)))
+                continue
+            # Depois do primeiro erro só valida, para listar todos de uma vez
+            if not failures or skip_invalid:
+                yield record
+        if failures and not skip_invalid:
+            raise ImportValidationError(failures)
+
+    def report(done):
+        fraction = None
+        if size:
+            try:
+                fraction = min(fileobj.tell() / size, 1.0)
+            except (AttributeError, OSError):
+                pass
+        progress(done, fraction)
+
+    imported = add_maintenance_records(_batches(records(), batch_size), progress=progress and report)
+    if progress:
+        progress(imported, 1.0)
+    return ImportResult(imported, failures)
+
+
+def _print_failures(failures):
+    for line, error in failures[:CLI_MAX_FAILURES]:
+        print(f"  linha {line}: {error}")
+    if len(failures) > CLI_MAX_FAILURES:
+        print(f"  ... e mais {len(failures) - CLI_MAX_FAILURES}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa veículos ou manutenções de arquivos CSV/JSON")
+    parser.add_argument('kind', choices=['veiculos', 'manutencoes'], help="o que importar")
+    parser.add_argument('path', help="arquivo .csv, .json, .jsonl ou .ndjson")
+    parser.add_argument('--autor', help="autor das manutenções sem essa coluna")
+    parser.add_argument('--sem-fipe', action='store_true', help="não consulta a FIPE (exige a coluna de valor FIPE)")
+    parser.add_argument('--ignorar-invalidas', action='store_true', help="importa as linhas válidas e lista as demais")
+    parser.add_argument('--lote', type=int, default=IMPORT_BATCH_SIZE, help="linhas por lote")
+    args = parser.parse_args()
+
+    init_db()
+
+    def progress(done, fraction):
+        suffix = f" ({fraction:.0%})" if fraction is not None else ""
+        print(f"\r{done} registros{suffix}", end='', flush=True)
+
+    try:
+        with open(args.path, 'rb') as fileobj:
+            if args.kind == 'veiculos':
+                result = import_vehicles(
+                    fileobj, args.path, resolve_fipe=not args.sem_fipe,
+                    skip_invalid=args.ignorar_invalidas, batch_size=args.lote, progress=progress
+                )
+            else:
+                result = import_maintenance(
+                    fileobj, args.path, author=args.autor,
+                    skip_invalid=args.ignorar_invalidas, batch_size=args.lote, progress=progress
+                )
+    except ImportValidationError as e:
+        print()
+        print(e)
+        _print_failures(e.failures)
+        raise SystemExit(1)
+    except ValueError as e:
+        print()
+        print(f"Erro: {e}")
+        raise SystemExit(1)
+
+    print()
+    print(f"{result.imported} registros importados, {len(result.failures)} linhas ignoradas")
+    _print_failures(result.failures)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Desligado por padrão: os decoradores devolvem a função original e as
+# seções viram um nullcontext, sem nenhum custo nos caminhos quentes
+METRICS_ENABLED = os.environ.get('CARRO_METRICS', '').lower() in ('1', 'true', 'yes')
+
+_lock = threading.Lock()
+_timers = {}  # (nome, rótulo) -> [contagem, soma em segundos, máximo]
+_counters = {}  # (nome, rótulo) -> valor
+_collectors = []  # funções que devolvem métricas calculadas na hora
+_NULL_SECTION = nullcontext()
+
+
+def enabled():
+    return METRICS_ENABLED
+
+
+def _observe(key, elapsed):
+    with _lock:
+        timer = _timers.get(key)
+        if timer is None:
+            _timers[key] = [1, elapsed, elapsed]
+        else:
+            timer[0] += 1
+            timer[1] += elapsed
+            if elapsed > timer[2]:
+                timer[2] = elapsed
+
+
+def timed(name, label=None):
+    """
+    Decorator recording call count and latency of a function under
+    `name{fn=label}`. Returns the function untouched when metrics are off
+    """
+    def decorator(fn):
+        if not METRICS_ENABLED:
+            return fn
+        key = (name, label or fn.__name__)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _observe(key, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def instrument(namespace, name, exclude=()):
+    """
+    Wrap every public function defined in a module with `timed(name)`;
+    call at the end of the module with `instrument(globals(), ...)`
+    """
+    if not METRICS_ENABLED:
+        return
+    module = namespace['__name__']
+    for attr, value in list(namespace.items()):
+        if (attr.startswith('_') or attr in exclude or not callable(value) or isinstance(value, type)
+                or getattr(value, '__module__', None) != module):
+            continue
+        namespace[attr] = timed(name, attr)(value)
+
+
+def section(name):
+    """
+    Context manager timing a block (e.g. a page section) under `section{fn=name}`
+    """
+    if not METRICS_ENABLED:
+        return _NULL_SECTION
+    return _timed_section(('section', name))
+
+
+@contextmanager
+def _timed_section(key):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _observe(key, time.perf_counter() - start)
+
+
+def increment(name, label='', value=1):
+    if not METRICS_ENABLED:
+        return
+    key = (name, label)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def register_collector(collector):
+    """
+    Register a function returning [(metric name, {label: value}, value)]
+    read at dump time, for numbers that other components already keep
+    """
+    _collectors.append(collector)
+    return collector
+
+
+def snapshot():
+    """
+    Copy of the recorded data: {'timers': [...], 'counters': [...], 'gauges': [...]}
+    """
+    with _lock:
+        timers = [
+            {'name': name, 'fn': label, 'count': count, 'total_ms': total * 1000,
+             'avg_ms': total / count * 1000, 'max_ms': maximum * 1000}
+            for (name, label), (count, total, maximum) in sorted(_timers.items())
+        ]
+        counters = [
+            {'name': name, 'label': label, 'value': value}
+            for (name, label), value in sorted(_counters.items())
+        ]
+    gauges = [sample for collector in _collectors for sample in collector()]
+    return {'timers': timers, 'counters': counters, 'gauges': gauges}
+
+
+def reset():
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def prometheus_text():
+    """
+    Dump every metric in the Prometheus text exposition format
+    """
+    data = snapshot()
+    lines = []
+
+    by_name = {}
+    for timer in data['timers']:
+        by_name.setdefault(timer['name'], []).append(timer)
+    for name, timers in by_name.items():
+        metric = f'carro_{name}_seconds'
+        lines.append(f'# TYPE {metric} summary')
+        for timer in timers:
+            labels = _labels({'fn': timer['fn']})
+            lines.append(f"{metric}_count{labels} {timer['count']}")
+            lines.append(f"{metric}_sum{labels} {timer['total_ms'] / 1000:.6f}")
+        lines.append(f'# TYPE {metric}_max gauge')
+        for timer in timers:
+            lines.append(f"{metric}_max{_labels({'fn': timer['fn']})} {timer['max_ms'] / 1000:.6f}")
+
+    declared = set()
+    for counter in data['counters']:
+        metric = f"carro_{counter['name']}_total"
+        if metric not in declared:
+            lines.append(f'# TYPE {metric} counter')
+            declared.add(metric)
+        labels = _labels({'kind': counter['label']} if counter['label'] else {})
+        lines.append(f"{metric}{labels} {counter['value']}")
+
+    # Amostras da mesma métrica precisam ficar juntas no formato de texto
+    for name, labels, value in sorted(data['gauges'], key=lambda sample: sample[0]):
+        metric = f'carro_{name}'
+        if metric not in declared:
+            lines.append(f'# TYPE {metric} gauge')
+            declared.add(metric)
+        lines.append(f'{metric}{_labels(labels)} {value}')
+
+    return '\n'.join(lines) + '\n'
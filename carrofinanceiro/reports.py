@@ -0,0 +1,50 @@
+import csv
+import gzip
+import io
+
+from database import iter_maintenance_records
+
+# Coluna do banco -> cabeçalho do relatório
+MAINTENANCE_REPORT_COLUMNS = {
+    'date': 'Data',
+    'brand': 'Marca',
+    'model': 'Modelo',
+    'year': 'Ano',
+    'description': 'Descrição',
+    'cost': 'Custo',
+    'mileage': 'Quilometragem',
+}
+
+def iter_maintenance_csv(date_from=None, date_to=None, vehicle_ids=None, chunk_size=500):
+    """
+    Generate the maintenance report as UTF-8 CSV chunks, one per block of rows
+    (the header goes with the first block; nothing is yielded without records)
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(MAINTENANCE_REPORT_COLUMNS.values())
+
+    for rows in iter_maintenance_records(date_from, date_to, vehicle_ids, chunk_size):
+        writer.writerows(
+            [row[column] for column in MAINTENANCE_REPORT_COLUMNS]
+            for row in rows
+        )
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+def write_maintenance_report(fileobj, compress=False, **filters):
+    """
+    Stream the maintenance report into a binary file object, optionally gzip
+    compressed. Returns the number of bytes of CSV written (0 = no records)
+    """
+    output = gzip.GzipFile(fileobj=fileobj, mode='wb') if compress else fileobj
+    written = 0
+    try:
+        for chunk in iter_maintenance_csv(**filters):
+            output.write(chunk)
+            written += len(chunk)
+    finally:
+        if compress:
+            output.close()
+    return written
@@ -0,0 +1,128 @@
+import argparse
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from database import init_db, get_vehicles, update_fipe_prices
+from fipe_api import (
+    RateLimiter, job_rate_limit, get_fipe_brand_index, get_fipe_model_index, get_fipe_year_index,
+    fetch_current_fipe_price, parse_fipe_price, parse_fipe_month
+)
+
+logger = logging.getLogger(__name__)
+
+# Padrões da reavaliação (o limite do cliente FIPE também continua valendo)
+REVALUATION_WORKERS = 8
+REVALUATION_RATE_LIMIT = 5  # requisições por segundo
+
+RevaluationResult = namedtuple('RevaluationResult', ['updated', 'failures'])
+
+
+def resolve_fipe_codes(brand, model, year):
+    """
+    Resolve the FIPE codes of a vehicle from the names stored in the database
+    """
+    brand_code = get_fipe_brand_index().code(brand)
+    if brand_code is None:
+        raise LookupError(f"Marca não encontrada na FIPE: {brand}")
+
+    model_code = get_fipe_model_index(brand_code).code(model)
+    if model_code is None:
+        raise LookupError(f"Modelo não encontrado na FIPE: {model}")
+
+    year_code = get_fipe_year_index(brand_code, model_code).code(year)
+    if year_code is None:
+        raise LookupError(f"Ano não encontrado na FIPE: {year}")
+    return brand_code, model_code, year_code
+
+
+def _fetch_price(key, rate_limiter):
+    # Catálogos ainda fora do cache também contam no limite da reavaliação
+    with job_rate_limit(rate_limiter):
+        codes = resolve_fipe_codes(*key)
+        fipe_data = fetch_current_fipe_price(*codes)
+    return parse_fipe_price(fipe_data), parse_fipe_month(fipe_data)
+
+
+def fetch_fipe_prices(keys, workers=REVALUATION_WORKERS, rate_limit=REVALUATION_RATE_LIMIT, progress=None):
+    """
+    Fetch concurrently the current FIPE price of each (brand, model, year)
+    name triple. `progress(key)` is called after each one.
+    Returns ({key: (price, month)}, {key: error message})
+    """
+    rate_limiter = RateLimiter(rate=rate_limit, burst=max(1, workers))
+    prices = {}
+    failures = {}
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fipe-revaluation') as executor:
+        futures = {
+            executor.submit(_fetch_price, key, rate_limiter): key
+            for key in keys
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                prices[key] = future.result()
+            except Exception as e:
+                logger.error(f"Erro ao consultar {key}: {e}")
+                failures[key] = str(e)
+            if progress:
+                progress(key)
+    return prices, failures
+
+
+def revalue_fleet(workers=REVALUATION_WORKERS, rate_limit=REVALUATION_RATE_LIMIT, progress=None):
+    """
+    Fetch the current FIPE price of every vehicle concurrently and write all
+    updates, with their price-history snapshots, in one transaction. Vehicles
+    sharing brand/model/year are priced with a single request.
+    `progress(done, total)` is called after each one.
+    Returns RevaluationResult(updated, failures), failures being
+    (vehicle, error message) pairs.
+    """
+    vehicles = get_vehicles()
+    groups = {}
+    for vehicle in vehicles:
+        groups.setdefault((vehicle['brand'], vehicle['model'], vehicle['year']), []).append(vehicle)
+
+    done = 0
+
+    def group_done(key):
+        nonlocal done
+        done += len(groups[key])
+        if progress:
+            progress(done, len(vehicles))
+
+    group_prices, group_failures = fetch_fipe_prices(groups, workers, rate_limit, group_done)
+    prices = [
+        (vehicle['id'], fipe_price, month)
+        for key, (fipe_price, month) in group_prices.items()
+        for vehicle in groups[key]
+    ]
+    failures = [(vehicle, error) for key, error in group_failures.items() for vehicle in groups[key]]
+
+    if prices:
+        update_fipe_prices(prices)
+    return RevaluationResult(len(prices), failures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Atualiza o valor FIPE de todos os veículos")
+    parser.add_argument('--workers', type=int, default=REVALUATION_WORKERS, help="requisições simultâneas")
+    parser.add_argument('--rate', type=float, default=REVALUATION_RATE_LIMIT, help="requisições por segundo")
+    args = parser.parse_args()
+
+    init_db()
+    result = revalue_fleet(
+        workers=args.workers,
+        rate_limit=args.rate,
+        progress=lambda done, total: print(f"\r{done}/{total} veículos", end='', flush=True)
+    )
+    print()
+    print(f"{result.updated} veículos atualizados, {len(result.failures)} falhas")
+    for vehicle, error in result.failures:
+        print(f"  {vehicle['brand']} {vehicle['model']} ({vehicle['year']}): {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import io
+
+import pytest
+
+import database
+from importer import _integer, _money, _parse_maintenance, import_maintenance
+
+
+@pytest.mark.parametrize('raw, expected', [
+    ('1234.56', 1234.56),
+    ('R$ 1.234,56', 1234.56),
+    ('12,5', 12.5),
+    ('12.345', 12345.0),
+    ('1.234.567', 1234567.0),
+    ('12.34', 12.34),
+    ('12.3456', 12.3456),
+    (1500, 1500.0),
+])
+def test_money(raw, expected):
+    assert _money({'cost': raw}, 'cost') == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('raw', ['abc', '-10', '1,2,3'])
+def test_money_invalid(raw):
+    with pytest.raises(ValueError):
+        _money({'cost': raw}, 'cost')
+
+
+@pytest.mark.parametrize('raw, expected', [
+    ('7', 7),
+    (' 7 ', 7),
+    ('1.0', 1),
+    (7, 7),
+    (7.0, 7),
+])
+def test_integer_id(raw, expected):
+    assert _integer({'vehicle_id': raw}, 'vehicle_id') == expected
+
+
+@pytest.mark.parametrize('raw', ['1.5', '1.000', '12.345', 'x', '', True, 1.5])
+def test_integer_id_invalid(raw):
+    with pytest.raises(ValueError):
+        _integer({'vehicle_id': raw}, 'vehicle_id')
+
+
+@pytest.mark.parametrize('raw, expected', [
+    ('12345', 12345),
+    ('12345.0', 12345),
+    ('12.345', 12345),
+    ('1.234.567', 1234567),
+    (12345, 12345),
+])
+def test_integer_mileage(raw, expected):
+    assert _integer({'mileage': raw}, 'mileage', thousands=True) == expected
+
+
+@pytest.mark.parametrize('raw', ['12.5', '1234.567', '12.34.5'])
+def test_integer_mileage_invalid(raw):
+    with pytest.raises(ValueError):
+        _integer({'mileage': raw}, 'mileage', thousands=True)
+
+
+def test_parse_maintenance():
+    row = {
+        'vehicle_id': '1', 'date': '05/03/2024', 'description': ' Troca de óleo ',
+        'cost': 'R$ 1.250,00', 'mileage': '45.000',
+    }
+    assert _parse_maintenance(row, {1}, {}, 'Oficina') == {
+        'vehicle_id': 1, 'date': '2024-03-05', 'description': 'Troca de óleo',
+        'cost': 1250.0, 'mileage': 45000, 'author': 'Oficina',
+    }
+
+
+@pytest.fixture
+def vehicle_id(tmp_path):
+    database.configure(path=tmp_path / 'vehicles.db')
+    database.init_db()
+    database.add_vehicle({
+        'brand': 'Fiat', 'model': 'Uno', 'year': '2015 Gasolina', 'color': 'Branco',
+        'purchase_price': 20000.0, 'additional_costs': 0.0, 'fipe_price': 25000.0,
+    })
+    yield database.get_vehicles()[0]['id']
+    database.close_db()
+
+
+def test_import_maintenance_finishes_progress(vehicle_id):
+    lines = ['vehicle_id,date,description,cost,mileage,author']
+    lines += [f'{vehicle_id},2024-01-{day:02d},Revisão,100,{day}000,Ana' for day in range(1, 11)]
+    calls = []
+    upload = io.BytesIO('\n'.join(lines).encode())
+    result = import_maintenance(
+        upload, 'manutencoes.csv',
+        batch_size=3, progress=lambda done, fraction: calls.append((done, fraction))
+    )
+    assert result.imported == 10
+    assert not upload.closed
+    assert calls[-1] == (10, 1.0)
+    fractions = [fraction for _, fraction in calls]
+    assert None not in fractions
+    assert fractions == sorted(fractions)
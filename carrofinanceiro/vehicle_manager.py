@@ -1,26 +1,497 @@
+import argparse
 import base64
-from PIL import Image
+import logging
+import os
+import tarfile
+import tempfile
+import threading
+import time
+import unicodedata
+import zipfile
+from collections import namedtuple
 from io import BytesIO
 
+import metrics
+from database import (
+    init_db, store_image, store_image_derivatives, get_image, get_images_missing_derivatives,
+    get_image_variant, get_image_hashes, get_vehicles, attach_vehicle_images
+)
+from image_server import IMAGE_SERVER_PORT, IMAGE_SERVER_URL, start_server, image_server_url
+
+logger = logging.getLogger(__name__)
+
+# O Pillow é importado dentro das funções que decodificam ou geram imagens:
+# listar veículos e publicar fotos prontas não precisa carregá-lo
+
+# Formato das derivadas geradas no upload (JPEG ou WEBP)
+IMAGE_FORMAT = os.environ.get('CARRO_IMAGE_FORMAT', 'JPEG').upper()
+
+# Derivadas geradas no upload: nome -> (tamanho máximo, qualidade)
+DERIVATIVES = {
+    'thumb': ((160, 160), 70),
+    'display': ((800, 800), 85),
+}
+
+# Limite de pixels aceito antes de decodificar (protege a memória contra fotos enormes)
+MAX_IMAGE_PIXELS = int(os.environ.get('CARRO_MAX_IMAGE_PIXELS', 50_000_000))
+
+# Importação em lote de fotos
+IMPORT_WORKERS = int(os.environ.get('CARRO_IMPORT_WORKERS', os.cpu_count() or 2))
+IMPORT_BATCH_SIZE = 50  # fotos gravadas por transação
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+EXIF_ORIENTATION = 0x0112
+
+MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+    'PNG': 'image/png',
+}
+
+EXTENSIONS = {
+    'image/jpeg': 'jpg',
+    'image/webp': 'webp',
+    'image/png': 'png',
+    'image/gif': 'gif',
+}
+
+# Fotos servidas pelo static serving do Streamlit (server.enableStaticServing),
+# a partir da pasta static/ ao lado do app.py
+STATIC_IMAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'img')
+STATIC_IMAGE_URL = 'app/static/img'
+
+_published = {}  # (hash, variante) -> URL
+_publish_lock = threading.Lock()
+_image_server_failed = False  # a porta estava ocupada: usa o static serving ou a foto embutida
+_inline_warned = False
+
+ImageVariant = namedtuple('ImageVariant', ['data', 'mime_type', 'width', 'height'])
+PhotoImportResult = namedtuple('PhotoImportResult', ['imported', 'unmatched', 'failures'])
+
+def _output_format():
+    from PIL import features
+
+    if IMAGE_FORMAT == 'WEBP' and not features.check('webp'):
+        return 'JPEG'
+    return IMAGE_FORMAT if IMAGE_FORMAT in MIME_TYPES else 'JPEG'
+
+def _encode(image, max_size, quality, image_format):
+    from PIL import Image
+
+    resized = image.copy()
+    resized.thumbnail(max_size, Image.LANCZOS)
+    if image_format == 'JPEG' and resized.mode not in ('RGB', 'L'):
+        resized = resized.convert('RGB')
+
+    buffer = BytesIO()
+    resized.save(buffer, format=image_format, quality=quality, optimize=True)
+    return ImageVariant(buffer.getvalue(), MIME_TYPES[image_format], resized.width, resized.height), resized
+
+def build_derivatives(image):
+    """
+    Generate every configured derivative (thumbnail, display) from a PIL image.
+    Each one is resized from the previous, larger derivative
+    """
+    image_format = _output_format()
+    derivatives = {}
+    for name, (max_size, quality) in sorted(DERIVATIVES.items(), key=lambda item: item[1][0], reverse=True):
+        derivatives[name], image = _encode(image, max_size, quality, image_format)
+    return derivatives
+
+def _open_reduced(data):
+    """
+    Open an image decoding no more pixels than the largest derivative needs:
+    JPEGs are decoded at 1/2, 1/4 or 1/8 scale by libjpeg (draft mode).
+    Returns the image and its full-resolution size
+    """
+    from PIL import Image
+
+    image = Image.open(BytesIO(data))
+    size = image.size
+    if image.width * image.height > MAX_IMAGE_PIXELS:
+        raise ValueError(
+            f"imagem de {image.width}x{image.height} excede o limite de {MAX_IMAGE_PIXELS:,} pixels"
+        )
+
+    if image.format == 'JPEG':
+        largest = max(max_size for max_size, _ in DERIVATIVES.values())
+        image.draft(image.mode if image.mode in ('RGB', 'L') else None, largest)
+    image.load()
+    return image, size
+
+def _jpeg_segments(data):
+    # Marcadores até o início dos dados comprimidos (SOS), que seguem intactos
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        if marker == 0xDA:
+            break
+        length = int.from_bytes(data[pos + 2:pos + 4], 'big')
+        yield marker, data[pos:pos + 2 + length]
+        pos += 2 + length
+    yield None, data[pos:]
+
+def _strip_jpeg_metadata(data, orientation):
+    kept = []
+    for marker, segment in _jpeg_segments(data):
+        # Mantém JFIF (APP0), perfil ICC (APP2) e Adobe (APP14); descarta EXIF, XMP, IPTC e comentários
+        if marker is None or not (0xE1 <= marker <= 0xEF or marker == 0xFE) or marker in (0xE2, 0xEE):
+            kept.append(segment)
+    if orientation != 1:
+        # Só a orientação sobrevive, para o original continuar de pé
+        from PIL import Image
+
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION] = orientation
+        payload = exif.tobytes()
+        app1 = b'\xff\xe1' + (len(payload) + 2).to_bytes(2, 'big') + payload
+        kept.insert(1 if kept and kept[0][:2] == b'\xff\xe0' else 0, app1)
+    return b'\xff\xd8' + b''.join(kept)
+
+def _strip_png_metadata(data):
+    kept = [data[:8]]
+    pos = 8
+    while pos + 8 <= len(data):
+        length = int.from_bytes(data[pos:pos + 4], 'big')
+        chunk_type = data[pos + 4:pos + 8]
+        end = pos + 12 + length
+        if chunk_type not in (b'tEXt', b'zTXt', b'iTXt', b'eXIf', b'tIME'):
+            kept.append(data[pos:end])
+        pos = end
+    return b''.join(kept)
+
+def strip_metadata(data, image_format, orientation=1):
+    """
+    Remove camera metadata (EXIF with GPS, XMP, text chunks) from the
+    original without re-encoding its pixels
+    """
+    if image_format == 'JPEG' and data[:2] == b'\xff\xd8':
+        return _strip_jpeg_metadata(data, orientation)
+    if image_format == 'PNG' and data[:8] == b'\x89PNG\r\n\x1a\n':
+        return _strip_png_metadata(data)
+    return data
+
+@metrics.timed('image')
 def save_image(image_file):
     """
-    Convert uploaded image to base64 string for storage
+    Build the stored variants of an uploaded image: the original without
+    metadata plus the derivatives used for rendering, decoded at reduced
+    size and turned upright according to the EXIF orientation
     """
     if image_file is None:
         return None
-        
+
+    from PIL import Image, ImageOps
+
     try:
-        # Open and compress the image
-        image = Image.open(image_file)
-        max_size = (800, 800)
-        image.thumbnail(max_size, Image.LANCZOS)
-        
-        # Convert to JPEG format
-        buffer = BytesIO()
-        image.save(buffer, format="JPEG", quality=85, optimize=True)
-        image_bytes = buffer.getvalue()
-        
-        # Convert to base64
-        return base64.b64encode(image_bytes).decode()
+        data = image_file if isinstance(image_file, bytes) else image_file.getvalue()
+        image, (width, height) = _open_reduced(data)
+        image_format = image.format
+        orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+        if orientation in (5, 6, 7, 8):
+            width, height = height, width
+
+        variants = build_derivatives(ImageOps.exif_transpose(image))
+        variants['original'] = ImageVariant(
+            strip_metadata(data, image_format, orientation),
+            Image.MIME.get(image_format, 'application/octet-stream'), width, height
+        )
+        return variants
     except Exception as e:
         raise Exception(f"Erro ao processar imagem: {str(e)}")
+
+@metrics.timed('image')
+def store_vehicle_image(image_file):
+    """
+    Process an upload and store it with its derivatives; returns the image hash
+    """
+    variants = save_image(image_file)
+    if variants is None:
+        return None
+
+    original = variants.pop('original')
+    return store_image(original.data, original.mime_type, variants)
+
+def image_url(image_hash, variant='display'):
+    """
+    Stable URL of a stored image, named by its content hash, served with the
+    stored bytes (never re-encoded). With CARRO_IMAGE_SERVER_PORT set the
+    URL points at the image server; otherwise the bytes are written once to
+    the static folder served by Streamlit. Falls back to the original when
+    the derivative is missing. When neither is available only thumbnails
+    go inline as data: URLs; other variants return None and the caller
+    renders the bytes itself. Returns None for unknown images
+    """
+    if not image_hash:
+        return None
+    base_url = _image_server_base_url()
+    if base_url:
+        return image_server_url(image_hash, variant, base_url)
+    if not _static_serving_enabled():
+        return _inline_url(image_hash, variant)
+
+    for candidate in (variant, 'original'):
+        key = (image_hash, candidate)
+        url = _published.get(key) or _find_published(key) or _publish(key)
+        if url:
+            return url
+    return None
+
+def _image_server_base_url():
+    global _image_server_failed
+    if not IMAGE_SERVER_PORT or _image_server_failed:
+        return None
+    try:
+        start_server()
+    except OSError as e:
+        # Porta ocupada (outro processo ou recarga do módulo): a página continua sem o servidor
+        logger.warning(f"Servidor de fotos indisponível na porta {IMAGE_SERVER_PORT}: {e}")
+        _image_server_failed = True
+        return None
+    return IMAGE_SERVER_URL or _request_base_url()
+
+def _request_base_url():
+    # Mesmo host que o navegador usou para abrir o app, na porta do servidor de fotos
+    import streamlit as st
+    from urllib.parse import urlsplit
+
+    try:
+        host = urlsplit('//' + st.context.headers.get('Host', '')).hostname
+    except Exception:
+        host = None
+    if not host:
+        return None
+    if ':' in host:
+        host = f'[{host}]'  # IPv6
+    return f"http://{host}:{IMAGE_SERVER_PORT}"
+
+def _static_serving_enabled():
+    import streamlit as st
+
+    # A configuração só é lida de ~/.streamlit e da pasta de onde o app foi iniciado
+    return bool(st.get_option('server.enableStaticServing'))
+
+def _inline_url(image_hash, variant):
+    global _inline_warned
+    # A foto embutida vai inteira a cada rerun, sem cache: só miniaturas
+    if variant != 'thumb':
+        return None
+    if not _inline_warned:
+        _inline_warned = True
+        logger.warning(
+            "Static serving desligado e sem servidor de fotos: miniaturas embutidas na página. "
+            "Ative server.enableStaticServing no .streamlit/config.toml da pasta de onde o app é iniciado."
+        )
+    image = get_image_variant(image_hash, 'thumb')
+    if image is None:
+        return None
+    return f"data:{image['mime_type']};base64,{base64.b64encode(image['data']).decode('ascii')}"
+
+def _static_path(key, extension):
+    image_hash, variant = key
+    return os.path.join(STATIC_IMAGE_DIR, f"{image_hash}-{variant}.{extension}")
+
+def _remember(key, extension):
+    image_hash, variant = key
+    # O hash já está no caminho; o ?v= faz o servidor responder com cache de longa duração
+    url = f"{STATIC_IMAGE_URL}/{image_hash}-{variant}.{extension}?v={image_hash[:16]}"
+    with _publish_lock:
+        _published[key] = url
+    return url
+
+def _find_published(key):
+    # Publicado por outro processo ou antes de um reinício
+    for extension in set(EXTENSIONS.values()):
+        if os.path.exists(_static_path(key, extension)):
+            return _remember(key, extension)
+    return None
+
+def _publish(key):
+    image = get_image_variant(*key)
+    if image is None:
+        return None
+
+    extension = EXTENSIONS.get(image['mime_type'], 'jpg')
+    os.makedirs(STATIC_IMAGE_DIR, exist_ok=True)
+    # Arquivo temporário + rename: ninguém lê um arquivo pela metade
+    fd, tmp_path = tempfile.mkstemp(dir=STATIC_IMAGE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(image['data'])
+        os.replace(tmp_path, _static_path(key, extension))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return _remember(key, extension)
+
+def prune_static_images():
+    """
+    Remove published files whose image no longer exists in the database
+    """
+    if not os.path.isdir(STATIC_IMAGE_DIR):
+        return 0
+    known = get_image_hashes()
+    removed = 0
+    for name in os.listdir(STATIC_IMAGE_DIR):
+        image_hash = name.split('-', 1)[0]
+        if image_hash not in known:
+            os.remove(os.path.join(STATIC_IMAGE_DIR, name))
+            removed += 1
+    with _publish_lock:
+        _published.clear()
+    return removed
+
+def backfill_derivatives():
+    """
+    Generate the missing derivatives for images stored before the pipeline existed
+    """
+    from PIL import ImageOps
+
+    done = 0
+    for image_hash in get_images_missing_derivatives(list(DERIVATIVES)):
+        image, _ = _open_reduced(get_image(image_hash))
+        store_image_derivatives(image_hash, build_derivatives(ImageOps.exif_transpose(image)))
+        done += 1
+    return done
+
+def _slug(text):
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode().lower()
+    return '-'.join(''.join(char if char.isalnum() else ' ' for char in text).split())
+
+def _photo_sources(source):
+    """
+    Yield (name, path or bytes) for every photo in a folder (recursively),
+    a zip or a tar archive
+    """
+    if os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if name.lower().endswith(PHOTO_EXTENSIONS):
+                    yield name, os.path.join(root, name)
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.lower().endswith(PHOTO_EXTENSIONS):
+                    yield os.path.basename(info.filename), archive.read(info)
+    elif tarfile.is_tarfile(source):
+        with tarfile.open(source) as archive:
+            for member in archive:
+                if member.isfile() and member.name.lower().endswith(PHOTO_EXTENSIONS):
+                    yield os.path.basename(member.name), archive.extractfile(member).read()
+    else:
+        raise ValueError(f"{source} não é uma pasta nem um arquivo zip/tar")
+
+def _photo_matcher(vehicles):
+    """
+    Map a file name to a vehicle: "<id>.jpg" or "<id>_qualquer.jpg" by id,
+    otherwise "marca-modelo-ano.jpg" when exactly one vehicle has that name
+    """
+    ids = {vehicle['id'] for vehicle in vehicles}
+    by_slug = {}
+    for vehicle in vehicles:
+        by_slug.setdefault(_slug(f"{vehicle['brand']} {vehicle['model']} {vehicle['year']}"), []).append(vehicle['id'])
+
+    def match(name):
+        stem = os.path.splitext(name)[0]
+        prefix = stem.split('_', 1)[0].split('-', 1)[0]
+        if prefix.isdigit() and int(prefix) in ids:
+            return int(prefix)
+        candidates = by_slug.get(_slug(stem), [])
+        return candidates[0] if len(candidates) == 1 else None
+    return match
+
+def _process_photo(name, source):
+    # Roda nos processos do pool: decodificação e derivadas usam só CPU
+    data = source
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            data = f.read()
+    variants = save_image(data)
+    original = variants.pop('original')
+    return name, original.data, original.mime_type, variants
+
+def import_photos(source, workers=IMPORT_WORKERS, progress=None):
+    """
+    Import a folder or zip/tar archive of photos, matching each file to a
+    vehicle by name (see _photo_matcher). Photos are processed on a process
+    pool and written in batches from this process; archives are read as the
+    pool consumes them. `progress(done)` is called after each photo.
+    Returns PhotoImportResult(imported, unmatched, failures), the last two
+    listing file names and (name, error) pairs
+    """
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait  # multiprocessing só aqui
+
+    match = _photo_matcher(get_vehicles())
+    workers = max(1, workers)
+    imported = 0
+    unmatched = []
+    failures = []
+    batch = []
+    done = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        sources = _photo_sources(source)
+        exhausted = False
+        while True:
+            # Fila curta: as fotos de um arquivo não ficam todas na memória
+            while not exhausted and len(pending) < workers * 4:
+                try:
+                    name, photo = next(sources)
+                except StopIteration:
+                    exhausted = True
+                    break
+                vehicle_id = match(name)
+                if vehicle_id is None:
+                    unmatched.append(name)
+                else:
+                    pending[executor.submit(_process_photo, name, photo)] = (vehicle_id, name)
+            if not pending:
+                break
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                vehicle_id, name = pending.pop(future)
+                try:
+                    _, data, mime_type, derivatives = future.result()
+                    batch.append((vehicle_id, data, mime_type, derivatives))
+                except Exception as e:
+                    failures.append((name, str(e)))
+                done += 1
+                if progress:
+                    progress(done)
+
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                imported += attach_vehicle_images(batch)
+                batch = []
+
+    if batch:
+        imported += attach_vehicle_images(batch)
+    return PhotoImportResult(imported, unmatched, failures)
+
+def main():
+    parser = argparse.ArgumentParser(description="Manutenção das fotos dos veículos")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('backfill', help="gera as derivadas que faltam")
+    subparsers.add_parser('prune', help="remove fotos publicadas de imagens excluídas")
+    photos = subparsers.add_parser('import', help="importa fotos de uma pasta ou arquivo zip/tar")
+    photos.add_argument('source')
+    photos.add_argument('--workers', type=int, default=IMPORT_WORKERS)
+    args = parser.parse_args()
+
+    init_db()
+    if args.command == 'backfill':
+        print(f"Derivadas geradas para {backfill_derivatives()} imagens")
+    elif args.command == 'prune':
+        print(f"{prune_static_images()} arquivos removidos de {STATIC_IMAGE_DIR}")
+    else:
+        start = time.perf_counter()
+        result = import_photos(args.source, args.workers)
+        print(f"{result.imported} fotos importadas em {time.perf_counter() - start:.1f}s")
+        for name in result.unmatched:
+            print(f"Sem veículo correspondente: {name}")
+        for name, error in result.failures:
+            print(f"Falha em {name}: {error}")
+
+if __name__ == "__main__":
+    main()